@@ -0,0 +1,24 @@
+from enum import Enum
+
+
+class MoveActionType(Enum):
+    FILTER = 1
+    SELECT = 2
+
+
+class ProcessResult(Enum):
+    OK = 1
+    UNDO = 2
+    PREVIOUS = 3
+    NEXT = 4
+
+
+class MoveAction:
+    def __init__(self, from_path, to_path, action_type: MoveActionType, cache=None):
+        self.from_path = from_path
+        self.to_path = to_path
+        self.action_type = action_type
+        self.cache = cache
+        self.status = None  # MoveStatus once handed to a MoveExecutor
+        self.error = None
+
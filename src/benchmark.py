@@ -0,0 +1,353 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from argparse import Namespace
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import PIL
+from PIL import Image, ImageDraw, ImageFilter
+
+try:
+    import resource
+except ImportError:  # Windows, peak RSS is reported as None
+    resource = None
+
+logger = logging.getLogger("sortr.benchmark")
+
+RESOLUTIONS = ((640, 480), (1920, 1280), (4000, 3000))
+BLUR_RADII = (0, 1, 3, 8)
+# Mixed case on purpose, the scanner has to match them case-insensitively
+EXTENSIONS = ((".jpg", "JPEG"), (".JPG", "JPEG"), (".jpeg", "JPEG"), (".Jpeg", "JPEG"), (".png", "PNG"),
+              (".PNG", "PNG"))
+ORIENTATIONS = (1, 1, 1, 3, 6, 8)
+SCREEN_SIZE = (1920, 1080)
+STARTUP_PROBE = "SORTR_STARTUP_PROBE"  # Makes sortr.py report its first window and quit, see gui.py
+# Modules that should only be imported after the window is up
+DEFERRED_MODULES = ("numpy", "PIL.Image", "PIL.ImageTk", "engine", "sharpness", "quality", "review")
+
+
+def synthetic_image(rng, size, blur):
+    # Random shapes and lines over a gradient: real edges for the sharpness filters, blurred to order
+    width, height = size
+    image = Image.linear_gradient("L").resize(size).convert("RGB")
+    draw = ImageDraw.Draw(image)
+    for _ in range(60):
+        x0, y0 = rng.randrange(width), rng.randrange(height)
+        x1, y1 = x0 + rng.randrange(width // 4 + 1), y0 + rng.randrange(height // 4 + 1)
+        color = (rng.randrange(256), rng.randrange(256), rng.randrange(256))
+        if rng.random() < 0.5:
+            draw.rectangle([x0, y0, x1, y1], fill=color)
+        else:
+            draw.line([x0, y0, x1, y1], fill=color, width=rng.randrange(1, 6))
+    if blur > 0:
+        image = image.filter(ImageFilter.GaussianBlur(blur * max(size) / 1000))
+    return image
+
+
+def generate_corpus(directory, count=48, seed=0, depth=3, resolutions=RESOLUTIONS):
+    # Writes the same images for the same arguments: JPEG and PNG files of every resolution and blur level,
+    # spread over nested directories, with some EXIF orientations. Returns the sorted file paths.
+    rng = random.Random(seed)
+    paths = []
+    for i in range(count):
+        size = resolutions[i % len(resolutions)]
+        blur = BLUR_RADII[(i // len(resolutions)) % len(BLUR_RADII)]
+        extension, image_format = EXTENSIONS[i % len(EXTENSIONS)]
+        parts = [f"d{rng.randrange(3)}" for _ in range(rng.randrange(depth + 1))]
+        folder = os.path.join(directory, *parts)
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"img_{i:05d}_blur{blur}{extension}")
+        image = synthetic_image(rng, size, blur)
+        if image_format == "JPEG":
+            exif = Image.Exif()
+            exif[274] = ORIENTATIONS[i % len(ORIENTATIONS)]
+            image.save(path, image_format, quality=90, exif=exif.tobytes())
+        else:
+            image.save(path, image_format)
+        paths.append(path)
+    return sorted(paths)
+
+
+def peak_rss_kb():
+    if resource is None:
+        return None
+    scale = 1024 if sys.platform == "darwin" else 1  # ru_maxrss is bytes on macOS, KiB on Linux
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss // scale
+    return max(own, children)
+
+
+def load_pixels(paths, options):
+    from sharpness import open_for_scoring
+    return [np.asarray(open_for_scoring(path, options.resolution)) for path in paths]
+
+
+# Each benchmark gets the corpus directory, its sorted image paths, the options and whatever its setup
+# returned. It returns the number of items processed, or (items, seconds) if only part of it is timed.
+def bench_get_images(corpus, paths, options, state):
+    from scanner import get_images
+    return len(get_images(corpus))
+
+
+def bench_get_sharpness(corpus, paths, options, state):
+    from sharpness import get_sharpness
+    for path in paths:
+        get_sharpness(path, options.resolution)
+    return len(paths)
+
+
+def bench_gradient_sharpness(corpus, paths, options, state):
+    from sharpness import calculate_gradient_sharpness
+    for path in paths:
+        calculate_gradient_sharpness(path, options.resolution)
+    return len(paths)
+
+
+def bench_calculate_variance(corpus, paths, options, state):
+    from sharpness import calculate_variance
+    for pixels in state:
+        calculate_variance(pixels)
+    return len(state)
+
+
+def bench_correct_orientation(corpus, paths, options, state):
+    from orientation import correct_image_orientation
+    for path in paths:
+        with Image.open(path) as img:
+            correct_image_orientation(img).load()
+    return len(paths)
+
+
+def bench_prepare_image(corpus, paths, options, state):
+    from prefetch import prepare_image
+    for path in paths:
+        prepare_image(path, SCREEN_SIZE)
+    return len(paths)
+
+
+def bench_filter_blurry(corpus, paths, options, state):
+    # End to end on a fresh copy with an empty cache and journal, so every repeat starts cold
+    from defaults import DEFAULT_SETTINGS
+    from engine import SortrEngine
+    with tempfile.TemporaryDirectory() as scratch:
+        input_directory = os.path.join(scratch, "in")
+        shutil.copytree(corpus, input_directory)
+        settings = dict(DEFAULT_SETTINGS, input_directory=input_directory, output_directory="",
+                        scoring_workers=options.workers, scoring_resolution=options.resolution,
+                        cache_path=os.path.join(scratch, "scores.sqlite"),
+                        journal_path=os.path.join(scratch, "moves.journal"))
+        engine = SortrEngine(settings["journal_path"], settings["move_copy_workers"])
+        engine.is_running = True
+        start = time.perf_counter()
+        count = engine.filter_blurry(Namespace(**settings))
+        engine.close()
+        return count, time.perf_counter() - start
+
+
+BENCHMARKS = {
+    "get_images": (None, bench_get_images),
+    "get_sharpness": (None, bench_get_sharpness),
+    "calculate_gradient_sharpness": (None, bench_gradient_sharpness),
+    "calculate_variance": (load_pixels, bench_calculate_variance),  # Decoding is not part of this one
+    "correct_image_orientation": (None, bench_correct_orientation),
+    "prepare_image": (None, bench_prepare_image),
+    "filter_blurry": (None, bench_filter_blurry),
+}
+
+
+def run_benchmark(name, corpus, paths, options):
+    # Runs in its own process so the peak RSS belongs to this benchmark alone
+    logging.getLogger("sortr").setLevel(logging.WARNING)
+    baseline = peak_rss_kb()
+    setup, function = BENCHMARKS[name]
+    state = setup(paths, options) if setup is not None else None
+    timings = []
+    items = 0
+    for _ in range(options.repeat):
+        start = time.perf_counter()
+        items = function(corpus, paths, options, state)
+        elapsed = time.perf_counter() - start
+        if isinstance(items, tuple):
+            items, elapsed = items
+        timings.append(elapsed)
+    peak_rss = peak_rss_kb()
+    # tracemalloc slows every allocation down several times, so the heap is measured in an extra untimed pass
+    tracemalloc.start()
+    function(corpus, paths, options, state)
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "name": name,
+        "items": items,
+        "repeat": options.repeat,
+        "seconds": timings,
+        "min_seconds": min(timings),
+        "median_seconds": statistics.median(timings),
+        "median_per_item_ms": statistics.median(timings) / max(items, 1) * 1000,
+        "baseline_rss_kb": baseline,
+        "peak_rss_kb": peak_rss,
+        "peak_python_heap_kb": traced_peak // 1024,
+    }
+
+
+def import_times(module, cwd):
+    # (name, self seconds, cumulative seconds) for every module a fresh interpreter imports for module
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=cwd,
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed: {result.stderr.strip().splitlines()[-1]}")
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        times.append((name.strip(), int(own) / 1e6, int(cumulative) / 1e6))
+    return times
+
+
+def import_report(module, cwd, slowest=15):
+    times = import_times(module, cwd)
+    names = {name for name, _, _ in times}
+    return {
+        "module": module,
+        "seconds": next(cumulative for name, _, cumulative in times if name == module),
+        "modules": len(times),
+        "deferred_but_imported": [name for name in DEFERRED_MODULES if name in names],
+        "slowest": [{"module": name, "self_seconds": own, "cumulative_seconds": cumulative}
+                    for name, own, cumulative in sorted(times, key=lambda t: -t[2]) if name != module][:slowest],
+    }
+
+
+def time_to_first_window(command, cwd, timeout=120):
+    # Wall clock from launching command until it reports its first drawn window and a usable engine
+    env = dict(os.environ, **{STARTUP_PROBE: "1"})
+    with tempfile.TemporaryFile(mode="w+") as errors:
+        start = time.perf_counter()
+        process = subprocess.Popen(command, cwd=cwd, env=env, stdout=subprocess.PIPE, stderr=errors, text=True)
+        marks = {}
+        for line in process.stdout:
+            if line.startswith("startup:"):
+                marks[line.split(":", 1)[1].strip()] = time.perf_counter() - start
+        process.wait(timeout)
+        if "first_window" not in marks:
+            errors.seek(0)
+            lines = errors.read().strip().splitlines()
+            raise RuntimeError(lines[-1] if lines else f"exited with {process.returncode} before showing a window")
+    return marks
+
+
+def run_startup(options):
+    # Import time of the GUI module and launch to first window, of the sources or of a frozen build
+    source = os.path.dirname(os.path.abspath(__file__))
+    command = [options.executable] if options.executable else [sys.executable, os.path.join(source, "sortr.py")]
+    report = {"command": command, "budget_seconds": options.budget, "imports": import_report("gui", source)}
+    try:
+        launches = [time_to_first_window(command, source) for _ in range(options.repeat)]
+    except (OSError, RuntimeError) as e:
+        # Typically no display, e.g. on a headless CI runner
+        logger.info(f"Could not launch {' '.join(command)}: {e}")
+        report["first_window_error"] = str(e)
+        return report
+    first_window = [marks["first_window"] for marks in launches]
+    report.update({
+        "first_window_seconds": first_window,
+        "median_first_window_seconds": statistics.median(first_window),
+        "engine_ready_seconds": [marks.get("engine_ready") for marks in launches],
+        "within_budget": statistics.median(first_window) <= options.budget,
+    })
+    return report
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "pillow": PIL.__version__,
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def run(options):
+    corpus = options.corpus
+    temporary = None
+    if corpus is None:
+        temporary = tempfile.TemporaryDirectory()
+        corpus = temporary.name
+    try:
+        context = multiprocessing.get_context("spawn")
+        logger.info(f"Generating {options.count} images in {corpus}")
+        start = time.perf_counter()
+        # Generated in a child as well, a spawned process inherits the peak RSS of its parent
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            paths = executor.submit(generate_corpus, corpus, options.count, options.seed).result()
+        generation = time.perf_counter() - start
+        results = []
+        for name in options.only or BENCHMARKS:
+            logger.info(f"Running {name}")
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                results.append(executor.submit(run_benchmark, name, corpus, paths, options).result())
+        return {
+            "environment": environment(),
+            "corpus": {"count": options.count, "seed": options.seed, "generation_seconds": generation},
+            "settings": {"resolution": options.resolution, "workers": options.workers, "repeat": options.repeat},
+            "benchmarks": results,
+        }
+    finally:
+        if temporary is not None:
+            temporary.cleanup()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="benchmark", description="Time Sortr on a generated image corpus")
+    parser.add_argument("--corpus", help="Directory for the corpus, a temporary one is used if not given")
+    parser.add_argument("--count", type=int, default=48, help="Number of images to generate")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the corpus generator")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per benchmark, the median is reported")
+    parser.add_argument("--resolution", type=int, default=1024, help="Scoring resolution, 0 for full")
+    parser.add_argument("--workers", type=int, default=1, help="Scoring workers for filter_blurry")
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), help="Run only these benchmarks")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    parser.add_argument("--startup", action="store_true",
+                        help="Measure GUI import time and time to first window instead of the corpus benchmarks")
+    parser.add_argument("--executable", help="With --startup, launch this frozen build instead of sortr.py")
+    parser.add_argument("--budget", type=float, default=1.0, help="With --startup, seconds allowed to first window")
+    return parser
+
+
+def main(argv=None):
+    options = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr, format='%(asctime)s - %(levelname)s - %(message)s')
+    if options.startup:
+        report = {"environment": environment(), "startup": run_startup(options)}
+    else:
+        report = run(options)
+    text = json.dumps(report, indent=2)
+    if options.output:
+        with open(options.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,97 @@
+import bisect
+import os
+from datetime import datetime
+
+from PIL import Image
+
+from sharpness import open_file, to_grayscale
+
+HASH_SIZE = 8  # 8x8 comparisons per direction, a 128 bit hash
+EXIF_IFD = 0x8769
+DATE_TIME_ORIGINAL = 0x9003
+DATE_TIME = 0x0132
+
+
+def dhash(image, hash_size=HASH_SIZE) -> int:
+    # Difference hash: one bit per horizontally and per vertically adjacent pixel pair of a tiny grayscale
+    # thumbnail. The vertical half sees horizontal edges like a horizon, which the horizontal half misses.
+    gray = to_grayscale(image)
+    value = 0
+    for width, height, step in ((hash_size + 1, hash_size, 1), (hash_size, hash_size + 1, hash_size)):
+        pixels = gray.resize((width, height), Image.Resampling.BILINEAR).tobytes()
+        for row in range(hash_size):
+            for col in range(hash_size):
+                index = row * width + col
+                value = (value << 1) | (pixels[index] > pixels[index + step])
+    return value
+
+
+def capture_time(image):
+    # EXIF DateTimeOriginal (or DateTime) in seconds, None if the image has no usable timestamp
+    try:
+        exif = image.getexif()
+        text = exif.get_ifd(EXIF_IFD).get(DATE_TIME_ORIGINAL) or exif.get(DATE_TIME)
+        return datetime.strptime(str(text).strip("\x00 "), "%Y:%m:%d %H:%M:%S").timestamp() if text else None
+    except (AttributeError, KeyError, ValueError, SyntaxError):
+        return None
+
+
+def burst_key(path) -> dict:
+    # What burst grouping needs from an image: its difference hash and when it was taken
+    img = open_file(path)
+    taken = capture_time(img)
+    # JPEG only: decode at 1/8 scale, the hash only looks at 9x8 thumbnails
+    img.draft('L', (HASH_SIZE * 8, HASH_SIZE * 8))
+    return {"hash": dhash(img), "time": taken}
+
+
+def hamming(a, b) -> int:
+    return bin(a ^ b).count("1")
+
+
+def within(a, b, window):
+    return a is not None and b is not None and abs(a - b) <= window
+
+
+def find_groups(keys, max_distance=10, window=5):
+    # Groups (path, hash, capture time) triples in scan order into bursts. An image can join the group of the
+    # image just before it in its folder, or a group of any folder whose last image was taken at most window
+    # seconds apart from it, so a burst split across card folders stays one group. It joins the nearest of
+    # those whose first image is within max_distance of its hash. Comparing with the first image instead of
+    # chaining through matches keeps a run of similar but unrelated scenes apart. Groups are indexed by the
+    # time of their last image, so only the few groups in reach are compared. Groups and their members keep
+    # the input order.
+    groups = []
+    by_time = []  # (time of the last image, index) of every group with a capture time, sorted
+    latest = {}  # directory -> group of the last image seen in it
+    for path, value, taken in keys:
+        directory = os.path.dirname(path)
+        reachable = {}
+        if taken is not None:
+            start = bisect.bisect_left(by_time, (taken - window, -1))
+            end = bisect.bisect_right(by_time, (taken + window, len(groups)))
+            reachable = {index: groups[index] for _, index in by_time[start:end]}
+        previous = latest.get(directory)
+        # Adjacency only counts while the capture times do not tell the images apart
+        if previous is not None and None in (previous["last"], taken):
+            reachable[previous["index"]] = previous
+        candidates = [(hamming(value, group["first"]), -index, group) for index, group in reachable.items()]
+        candidates = [candidate for candidate in candidates if candidate[0] <= max_distance]
+        if candidates:
+            match = min(candidates, key=lambda candidate: candidate[:2])[2]
+        else:
+            match = {"index": len(groups), "first": value, "last": None, "members": []}
+            groups.append(match)
+        match["members"].append(path)
+        if taken is not None:
+            if match["last"] is not None:
+                del by_time[bisect.bisect_left(by_time, (match["last"], match["index"]))]
+            match["last"] = taken
+            bisect.insort(by_time, (taken, match["index"]))
+        latest[directory] = match
+    return [group["members"] for group in groups]
+
+
+def rank_group(group, sharpness):
+    # Sharpest first, ties keep the input order
+    return sorted(group, key=lambda path: -sharpness[path])
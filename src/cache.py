@@ -0,0 +1,176 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from instrumentation import count
+
+logger = logging.getLogger("sortr.cache")
+
+HASH_BLOCK_SIZE = 64 * 1024
+
+
+def default_cache_path():
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA", os.path.expanduser("~"))
+    elif sys.platform == "darwin":
+        base = os.path.expanduser("~/Library/Caches")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+    return os.path.join(base, "sortr", "scores.sqlite")
+
+
+def content_hash(path):
+    # Hashes the size plus the first and last block, enough to tell apart files that share a size and mtime
+    digest = hashlib.blake2b(digest_size=16)
+    size = os.path.getsize(path)
+    digest.update(str(size).encode())
+    with open(path, "rb") as f:
+        digest.update(f.read(HASH_BLOCK_SIZE))
+        if size > HASH_BLOCK_SIZE:
+            f.seek(max(HASH_BLOCK_SIZE, size - HASH_BLOCK_SIZE))
+            digest.update(f.read(HASH_BLOCK_SIZE))
+    return digest.hexdigest()
+
+
+class ScoreCache:
+    # Persistent per-file cache of sharpness scores and EXIF orientation. Entries are keyed on the path and
+    # are only trusted while the file size and mtime (and optionally the content hash) still match.
+    def __init__(self, path=None, max_entries=500000, use_hash=False, commit_every=500):
+        self.path = path if path else default_cache_path()
+        self.max_entries = max_entries
+        self.use_hash = use_hash
+        self.commit_every = commit_every
+        self.lock = threading.Lock()
+        self.pending_writes = 0
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, digest TEXT, "
+            "orientation INTEGER, scores TEXT, last_used REAL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS files_last_used ON files (last_used)")
+        self.connection.commit()
+
+    def identity(self, file_path):
+        stat = os.stat(file_path)
+        digest = content_hash(file_path) if self.use_hash else None
+        return stat.st_size, stat.st_mtime_ns, digest
+
+    def lookup(self, file_path):
+        # Returns (identity, row) where row is None if there is no valid entry for the current file
+        file_path = os.path.abspath(file_path)
+        identity = self.identity(file_path)
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT size, mtime_ns, digest, orientation, scores FROM files WHERE path = ?", (file_path,)
+            ).fetchone()
+        if row is None:
+            return identity, None
+        size, mtime_ns, digest = identity
+        if row[0] != size or row[1] != mtime_ns or (self.use_hash and row[2] != digest):
+            return identity, None
+        return identity, row
+
+    def get_score(self, file_path, key):
+        _, row = self.lookup(file_path)
+        scores = json.loads(row[4]) if row is not None and row[4] else {}
+        if key not in scores:
+            self.misses += 1
+            count("cache_misses")
+            return None
+        self.hits += 1
+        count("cache_hits")
+        self.touch(file_path)
+        return scores[key]
+
+    def put_score(self, file_path, key, value):
+        self.update(file_path, scores={key: value})
+
+    def get_orientation(self, file_path):
+        _, row = self.lookup(file_path)
+        if row is None or row[3] is None:
+            self.misses += 1
+            count("cache_misses")
+            return None
+        self.hits += 1
+        count("cache_hits")
+        self.touch(file_path)
+        return row[3]
+
+    def put_orientation(self, file_path, orientation):
+        self.update(file_path, orientation=orientation)
+
+    def update(self, file_path, scores=None, orientation=None):
+        file_path = os.path.abspath(file_path)
+        identity, row = self.lookup(file_path)
+        merged = json.loads(row[4]) if row is not None and row[4] else {}
+        if scores:
+            merged.update(scores)
+        if orientation is None and row is not None:
+            orientation = row[3]
+        size, mtime_ns, digest = identity
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO files (path, size, mtime_ns, digest, orientation, scores, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (file_path, size, mtime_ns, digest, orientation, json.dumps(merged), time.time())
+            )
+            self.written()
+
+    def touch(self, file_path):
+        with self.lock:
+            self.connection.execute(
+                "UPDATE files SET last_used = ? WHERE path = ?", (time.time(), os.path.abspath(file_path))
+            )
+            self.written()
+
+    def moved(self, from_path, to_path):
+        # shutil.move keeps size and mtime, so the entry stays valid under its new path
+        if os.path.isdir(to_path):
+            to_path = os.path.join(to_path, os.path.basename(from_path))
+        with self.lock:
+            self.connection.execute("DELETE FROM files WHERE path = ?", (os.path.abspath(to_path),))
+            self.connection.execute(
+                "UPDATE files SET path = ? WHERE path = ?", (os.path.abspath(to_path), os.path.abspath(from_path))
+            )
+            self.written()
+
+    def written(self):
+        self.pending_writes += 1
+        if self.pending_writes >= self.commit_every:
+            self.connection.commit()
+            self.pending_writes = 0
+
+    def evict(self):
+        # Drops the least recently used entries above max_entries
+        with self.lock:
+            count = self.connection.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+            excess = count - self.max_entries
+            if excess > 0:
+                logger.info(f"Evicting {excess} cache entries")
+                self.connection.execute(
+                    "DELETE FROM files WHERE path IN (SELECT path FROM files ORDER BY last_used LIMIT ?)", (excess,)
+                )
+            self.connection.commit()
+            self.pending_writes = 0
+
+    def flush(self):
+        with self.lock:
+            self.connection.commit()
+            self.pending_writes = 0
+
+    def close(self):
+        self.evict()
+        with self.lock:
+            self.connection.close()
+
@@ -0,0 +1,136 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import sys
+from argparse import Namespace
+
+from actions import MoveActionType
+from defaults import DEFAULT_SETTINGS
+from engine import SortrEngine
+from logs import LOG_FORMAT
+from shards import expand_result_paths
+
+logger = logging.getLogger("sortr")
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_INTERRUPTED = 130
+
+
+def parse_bool(value):
+    return value.lower() in ('true', '1', 'yes')
+
+
+def add_setting_arguments(parser):
+    # Every setting the GUI knows about is also a flag, e.g. sharpness_threshold -> --sharpness-threshold.
+    # Defaults are None so that values from --config are only overridden by flags actually given.
+    for key, default in DEFAULT_SETTINGS.items():
+        flag = "--" + key.replace("_", "-")
+        value_type = parse_bool if isinstance(default, bool) else type(default)
+        parser.add_argument(flag, dest=key, type=value_type, default=None, help=f"default: {default}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="sortr", description="Score, filter and undo without the GUI")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    stats = commands.add_parser("stats", help="Write sharpness statistics for every image")
+    filter_parser = commands.add_parser("filter", help="Move images under the sharpness threshold to .too_blurry")
+    undo = commands.add_parser("undo", help="Move files back using the move journal")
+    undo.add_argument("--type", choices=["filter", "select"], default="filter",
+                      help="Undo filtering moves or review selections")
+
+    manifest = commands.add_parser("manifest", help="Split the input tree into shard manifests for several nodes")
+    manifest.add_argument("--shards", type=int, required=True, help="Number of shards")
+    manifest.add_argument("--manifest-directory", required=True, help="Where to write the manifests")
+    score_shard = commands.add_parser("score-shard", help="Score the images of one manifest into a result file")
+    score_shard.add_argument("--manifest", required=True, help="Manifest file written by the manifest command")
+    score_shard.add_argument("--result", required=True, help="Result file, .jsonl or .csv")
+    merge = commands.add_parser("merge", help="Merge shard results into one statistics file")
+    merge.add_argument("--results", nargs="+", required=True, help="Result files or glob patterns")
+    merge.add_argument("--output", required=True, help="Merged statistics file, .jsonl or .csv")
+    merge.add_argument("--decisions", action="store_true", help="Add a keep/blurry Decision per image")
+    merge.add_argument("--apply", action="store_true", help="Also move the blurry images, implies --decisions")
+
+    watch = commands.add_parser("watch", help="Score new images as they arrive until interrupted")
+    watch.add_argument("--action", choices=["filter", "stats"], default=None,
+                       help="Move blurry images or append statistics, default: the watch_action setting")
+
+    for command in (stats, filter_parser, undo, manifest, score_shard, merge, watch):
+        command.add_argument("--config", help="JSON file with settings, flags take precedence")
+        add_setting_arguments(command)
+    return parser
+
+
+def load_settings(options):
+    settings = dict(DEFAULT_SETTINGS)
+    if options.config:
+        with open(options.config) as f:
+            settings.update(json.load(f))
+    for key in DEFAULT_SETTINGS:
+        value = getattr(options, key)
+        if value is not None:
+            settings[key] = value
+    return settings
+
+
+def setup_logging():
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+def main(argv=None):
+    options = build_parser().parse_args(argv)
+    setup_logging()
+    try:
+        settings = load_settings(options)
+    except (OSError, ValueError) as e:
+        logger.error(f"Could not read config {options.config}: {e}")
+        return EXIT_FAILED
+    args = Namespace(**settings)
+
+    engine = SortrEngine(args.journal_path, args.move_copy_workers)
+    engine.is_running = True
+    try:
+        engine.recover_moves(args)
+        if options.command == "stats":
+            engine.generate_stats(args)
+        elif options.command == "filter":
+            engine.filter_blurry(args)
+        elif options.command == "undo":
+            action_type = MoveActionType.FILTER if options.type == "filter" else MoveActionType.SELECT
+            engine.undo_all(action_type, args.input_directory)
+        elif options.command == "manifest":
+            engine.write_manifests(args, options.shards, options.manifest_directory)
+        elif options.command == "score-shard":
+            engine.score_manifest(args, options.manifest, options.result)
+        elif options.command == "merge":
+            engine.merge_shards(args, expand_result_paths(options.results, options.output), options.output,
+                                options.decisions or options.apply, options.apply)
+        elif options.command == "watch":
+            engine.watch(args, options.action if options.action else args.watch_action)
+    except KeyboardInterrupt:
+        engine.is_running = False
+        logger.info("Interrupted, finishing queued moves")
+        engine.close()
+        return EXIT_INTERRUPTED
+    except (OSError, ValueError) as e:
+        logger.error(f"{options.command} failed: {e}")
+        engine.close()
+        return EXIT_FAILED
+
+    engine.close()
+    if len(engine.mover.failures) > 0:
+        logger.error(f"{len(engine.mover.failures)} moves failed")
+        return EXIT_FAILED
+    return EXIT_OK
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    sys.exit(main())
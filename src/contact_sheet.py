@@ -0,0 +1,270 @@
+import logging
+import math
+import os
+import tkinter as tk
+from functools import partial
+
+from PIL import ImageTk
+
+from actions import MoveActionType
+from instrumentation import METRICS, start_profile, stop_profile, finish
+from prefetch import Prefetcher
+from review import ReviewSession, CHOICES
+from thumbnails import ThumbnailCache
+
+logger = logging.getLogger("sortr.contact_sheet")
+
+SELECTED_COLOR = "#2f80ed"
+SHIFT_MASK = 0x0001
+
+
+class GridReviewController(ReviewSession):
+    # Contact sheet review: pages of thumbnails from the on-disk thumbnail cache, generated by background
+    # workers, so paging never decodes an original at full size. Clicking toggles the selection, shift-click
+    # selects a range, y/m/n send the whole selection through handle_user_selection. Decided images leave the
+    # sheet and the page refills, undo brings back the last decision as a whole.
+    def __init__(self, gui, args, poll_interval=50):
+        super().__init__(gui, args)
+        self.poll_interval = poll_interval
+        self.per_page = max(1, args.grid_columns * args.grid_rows)
+
+        self.page = 0
+        self.page_paths = []
+        self.decided = set()
+        self.batches = []  # The images of every decision, in order, for undo
+        self.selected = set()
+        self.anchor = None  # Last clicked image, shift-click selects from here
+        self.shown = {}  # cell -> path whose thumbnail it displays
+        self.poll_job = None
+
+        thumbnails = ThumbnailCache(args.thumbnail_cache_path, args.thumbnail_cache_mb * 1024 * 1024,
+                                    args.thumbnail_size)
+        # The current page and the ones before and after it stay in memory
+        self.prefetcher = Prefetcher(partial(thumbnails.thumbnail, cache=self.engine.get_cache(args)),
+                                     workers=args.thumbnail_workers, capacity=self.per_page * 3)
+
+        self.start_scan()
+
+        self.build_window()
+
+    def build_window(self):
+        self.window = tk.Toplevel(self.root)
+        self.window.title("Contact Sheet Review")
+        self.window.attributes('-fullscreen', True)
+        self.window.protocol("WM_DELETE_WINDOW", self.exit_processing)
+
+        button_frame = tk.Frame(self.window)
+        button_frame.pack(side=tk.TOP, fill=tk.X)
+
+        self.page_label = tk.Label(button_frame, text="", font=("Arial", 14))
+        self.page_label.pack(side=tk.TOP, pady=10)
+
+        tk.Button(button_frame, text="Exit", command=self.exit_processing).pack(side=tk.LEFT, padx=10)
+        tk.Button(button_frame, text="Previous Page", command=partial(self.turn_page, -1)).pack(side=tk.LEFT, padx=10)
+        tk.Button(button_frame, text="Next Page", command=partial(self.turn_page, 1)).pack(side=tk.LEFT, padx=10)
+        tk.Button(button_frame, text="Select Page", command=self.select_page).pack(side=tk.LEFT, padx=10)
+        tk.Button(button_frame, text="Clear Selection", command=self.clear_selection).pack(side=tk.LEFT, padx=10)
+        for choice, text in (('y', "Yes"), ('m', "Maybe"), ('n', "No")):
+            tk.Button(button_frame, text=text, command=partial(self.decide, choice)).pack(side=tk.LEFT, padx=10)
+        self.undo_button = tk.Button(button_frame, text="Undo", command=self.undo, state=tk.DISABLED)
+        self.undo_button.pack(side=tk.LEFT, padx=10)
+
+        sheet = tk.Frame(self.window)
+        sheet.pack(expand=True)
+        cell_size = self.args.thumbnail_size + 12
+        self.cells = []
+        for i in range(self.per_page):
+            row, column = divmod(i, self.args.grid_columns)
+            sheet.grid_columnconfigure(column, minsize=cell_size)
+            sheet.grid_rowconfigure(row, minsize=cell_size + 20)
+            frame = tk.Frame(sheet, bd=0, padx=4, pady=4)
+            frame.grid(row=row, column=column, padx=2, pady=2)
+            image_label = tk.Label(frame)
+            image_label.pack()
+            caption = tk.Label(frame, text="", wraplength=self.args.thumbnail_size)
+            caption.pack()
+            for widget in (frame, image_label, caption):
+                widget.bind('<ButtonPress-1>', partial(self.on_click, i))
+            self.cells.append((frame, image_label, caption))
+        self.background = self.cells[0][0].cget("bg")
+
+        self.instruction = tk.Label(self.window, text="Click to select, shift-click for a range, then press 'y', 'm', "
+                                                      "or 'n'", bg='white')
+        self.instruction.pack(pady=10)
+
+        self.window.bind('<Key>', self.on_key)
+        self.window.bind('<Left>', lambda event: self.turn_page(-1))
+        self.window.bind('<Prior>', lambda event: self.turn_page(-1))
+        self.window.bind('<Right>', lambda event: self.turn_page(1))
+        self.window.bind('<Next>', lambda event: self.turn_page(1))
+        self.window.bind('<Control-a>', lambda event: self.select_page())
+        self.window.bind('<Escape>', lambda event: self.clear_selection())
+        self.window.focus_force()
+
+    def start(self):
+        logger.info("Step 1: Data loading...")
+        METRICS.reset()
+        self.profiler = start_profile(self.args.profile_path)
+        self.refresh()
+
+    def undecided(self):
+        return [path for path in list(self.images) if path not in self.decided]
+
+    def refresh(self):
+        # Fills the cells of the current page, polling with after() until every thumbnail is ready and the
+        # scan has finished
+        self.poll_job = None
+        if self.closed:
+            return
+        if not self.gui.is_running:
+            logger.info("Pipeline stopped.")
+            self.close()
+            return
+        visible = self.undecided()
+        if len(visible) == 0 and self.exhausted:
+            logger.info("No more images to review.")
+            self.close()
+            return
+        pages = max(1, math.ceil(len(visible) / self.per_page))
+        self.page = min(self.page, pages - 1)
+        start = self.page * self.per_page
+        self.page_paths = visible[start:start + self.per_page]
+        ready = True
+        for i in range(self.per_page):
+            if not self.fill(i, self.page_paths[i] if i < len(self.page_paths) else None):
+                ready = False
+        self.prefetcher.schedule(visible[start + self.per_page:start + 2 * self.per_page])
+
+        more = "" if self.exhausted else "+"
+        self.page_label.config(text=f"Page {self.page + 1} of {pages}{more}, {len(visible)}{more} images, "
+                                    f"{len(self.selected)} selected")
+        self.undo_button.config(state=tk.NORMAL if len(self.batches) > 0 else tk.DISABLED)
+        if not ready or not self.exhausted:
+            self.poll_job = self.window.after(self.poll_interval, self.refresh)
+
+    def fill(self, i, path):
+        # Shows the thumbnail of path in cell i, False while it is still being generated
+        frame, image_label, caption = self.cells[i]
+        frame.config(bg=SELECTED_COLOR if path in self.selected else self.background)
+        if self.shown.get(i) == path:
+            return True
+        if path is None:
+            image_label.config(image="")
+            image_label.image = None
+            caption.config(text="")
+            self.shown[i] = None
+            return True
+        if path not in self.prefetcher.entries and self.engine.mover.busy(path):
+            return False  # An undo of this image is still being applied
+        future = self.prefetcher.submit(path)
+        if not future.done():
+            image_label.config(image="")
+            image_label.image = None
+            caption.config(text=os.path.basename(path))
+            self.shown[i] = None
+            return False
+        try:
+            thumbnail = self.prefetcher.get(path)
+        except Exception as e:
+            logger.info(f"Could not open {path}: {e}")
+            caption.config(text=f"{os.path.basename(path)} (could not open)")
+            self.shown[i] = path
+            return True
+        img_tk = ImageTk.PhotoImage(thumbnail)
+        image_label.config(image=img_tk)
+        image_label.image = img_tk
+        group = self.group_of(path)
+        if len(group) > 1:
+            caption.config(text=f"{os.path.basename(path)} (sharpest of {len(group)})")
+        else:
+            caption.config(text=os.path.basename(path))
+        self.shown[i] = path
+        return True
+
+    def redraw(self):
+        self.cancel_poll()
+        self.refresh()
+
+    def turn_page(self, step):
+        pages = max(1, math.ceil(len(self.undecided()) / self.per_page))
+        page = min(max(0, self.page + step), pages - 1)
+        if page != self.page:
+            self.page = page
+            self.redraw()
+
+    def on_click(self, i, event):
+        if i >= len(self.page_paths):
+            return
+        path = self.page_paths[i]
+        if event.state & SHIFT_MASK and self.anchor is not None:
+            visible = self.undecided()
+            if self.anchor in visible:
+                a, b = sorted((visible.index(self.anchor), visible.index(path)))
+                self.selected.update(visible[a:b + 1])
+                self.redraw()
+                return
+        if path in self.selected:
+            self.selected.discard(path)
+        else:
+            self.selected.add(path)
+        self.anchor = path
+        self.redraw()
+
+    def select_page(self):
+        self.selected.update(self.page_paths)
+        self.redraw()
+
+    def clear_selection(self):
+        self.selected.clear()
+        self.anchor = None
+        self.redraw()
+
+    def on_key(self, event):
+        if event.char in CHOICES:
+            self.decide(event.char)
+
+    def decide(self, choice):
+        batch = [path for path in self.undecided() if path in self.selected]
+        if len(batch) == 0:
+            return
+        logger.info(f"{CHOICES[choice]} for {len(batch)} images")
+        for path in batch:
+            self.engine.handle_group_selection(self.group_of(path), choice, self.args)
+            METRICS.count("decisions")
+        self.decided.update(batch)
+        self.batches.append(batch)
+        self.selected.clear()
+        self.anchor = None
+        self.redraw()
+
+    def undo(self):
+        if len(self.batches) == 0:
+            return
+        batch = self.batches.pop()
+        logger.info(f"Undoing the last decision for {len(batch)} images")
+        for path in reversed(batch):
+            for _ in self.group_of(path):
+                self.engine.undo_last(MoveActionType.SELECT)
+        self.decided.difference_update(batch)
+        self.selected = set(batch)  # Selected again, ready for a different decision
+        self.redraw()
+
+    def exit_processing(self):
+        logger.info("Exiting image processing")
+        self.close()
+
+    def cancel_poll(self):
+        if self.poll_job is not None:
+            self.window.after_cancel(self.poll_job)
+            self.poll_job = None
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.cancel_poll()
+        self.prefetcher.shutdown()
+        self.window.destroy()
+        stop_profile(self.profiler, self.args.profile_path)
+        finish("grid-review", self.args.metrics_path)
+        self.gui.review_finished()
@@ -0,0 +1,52 @@
+import os
+
+
+def default_workers():
+    return os.cpu_count() or 1
+
+
+# Kept apart from the engine so the GUI can build its window and settings without importing the imaging stack
+DEFAULT_SETTINGS = {
+    "input_directory": "/home/alex/data/04_FIN-PRINT-v2/demo_JTowers/SRC",
+    "output_directory": "/home/alex/data/04_FIN-PRINT-v2/demo_JTowers/OUT",
+    "sharpness_threshold": 500,
+    "scoring_workers": default_workers(),
+    "scoring_resolution": 0,
+    "calibration_samples": 16,
+    "cache_path": "",
+    "cache_max_entries": 500000,
+    "cache_content_hash": False,
+    "prefetch_count": 3,
+    "move_copy_workers": 4,
+    "journal_path": "",
+    "log_max_lines": 5000,
+    "log_to_file": False,
+    "stats_format": "jsonl",
+    "stats_resume": True,
+    "burst_grouping": False,
+    "burst_distance": 10,
+    "burst_window": 5,
+    "metrics_path": "",
+    "profile_path": "",
+    "watch_action": "filter",
+    "watch_backend": "auto",
+    "watch_interval": 2,
+    "quality_metrics": "sharpness",
+    "filter_rules": "",
+    "sharpness_mode": "global",
+    "tile_grid": 8,
+    "tile_percentile": 90,
+    "tile_map": False,
+    "review_mode": "single",
+    "grid_columns": 6,
+    "grid_rows": 4,
+    "thumbnail_size": 192,
+    "thumbnail_cache_path": "",
+    "thumbnail_cache_mb": 512,
+    "thumbnail_workers": 4,
+    "threshold_mode": "absolute",
+    "drop_percent": 20,
+    "keep_top": 10,
+    "decision_buffer": 500,
+    "sketch_size": 200
+}
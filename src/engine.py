@@ -0,0 +1,640 @@
+import logging
+import os
+import sys
+from datetime import datetime
+from functools import partial
+from itertools import chain, islice
+from typing import List
+
+from actions import MoveActionType, MoveAction
+from bursts import burst_key, find_groups, rank_group
+from cache import ScoreCache, default_cache_path
+from instrumentation import METRICS, instrumented
+from journal import MoveJournal
+from mover import MoveExecutor, MoveStatus, bulk_undo
+from parallel import score_images
+from quantiles import KLLSketch, PercentileSelector, TopSelector
+from quality import QUALITY_METRICS, measure_image, parse_metric_names, parse_rules, rule_metrics, matched_rule, \
+    quality_key, format_rule, rescale_rules, scaled_metrics, missing_metrics
+from scanner import iter_images
+from sharpness import ScoreCalibration, downscale_factor, score_image
+from shards import write_manifests, read_manifest, relative_key, save_calibration, load_calibration, merge_results, \
+    save_sketch, load_sketch, calibration_path, same_path, CALIBRATION_FILE
+from stats_writer import StatsWriter, STATS_FIELDS, format_for, read_records, resumable_path
+from watcher import create_watcher
+
+logger = logging.getLogger("sortr.engine")
+
+
+def get_path_diff(path1, path2):
+    replaced = path2.replace(path1, "")
+    if len(replaced) > 0 and replaced[0] == os.sep:
+        replaced = replaced[1:]
+    return replaced
+
+
+def is_inside(path, directory):
+    directory = os.path.abspath(directory)
+    try:
+        return os.path.commonpath([os.path.abspath(path), directory]) == directory
+    except ValueError:  # Different drives
+        return False
+
+
+class SortrEngine:
+    # Filtering, statistics and move bookkeeping without any Tk, shared by the GUI and the command line.
+    # Long running methods take the settings as a Namespace and stop early once is_running is cleared.
+    def __init__(self, journal_path="", move_copy_workers=4):
+        self.is_running = False
+        self.cache = None
+        self.journal = MoveJournal(journal_path)
+        self.mover = MoveExecutor(move_copy_workers, self.journal)
+        self.on_filter_move = None  # Called with each MoveAction filter_blurry submits
+
+        self.filter_history: List[MoveAction] = []
+        self.select_history: List[MoveAction] = []
+
+        self.yes_dir = "YES"
+        self.no_dir = "NO"
+        self.maybe_dir = "MAYBE"
+
+    def recover_moves(self, args):
+        # Moves from earlier sessions stay undoable, interrupted ones are finished or rolled back first. They
+        # keep the score cache up to date when they are undone, like the moves of this session.
+        for action in self.journal.recover(self.get_cache(args)):
+            if action.action_type == MoveActionType.FILTER:
+                self.filter_history.append(action)
+            else:
+                self.select_history.append(action)
+        if len(self.filter_history) + len(self.select_history) > 0:
+            logger.info(f"Restored {len(self.filter_history)} filter and {len(self.select_history)} "
+                        f"selection moves from {self.journal.path}")
+
+    def history(self, action_type: MoveActionType):
+        if action_type == MoveActionType.FILTER:
+            return self.filter_history
+        return self.select_history
+
+    def undo_last(self, action_type: MoveActionType):
+        history = self.history(action_type)
+        if len(history) == 0:
+            return
+
+        last = history.pop()
+        self.mover.undo(last)
+
+    def undo_all(self, action_type: MoveActionType, directory=None):
+        # With directory, only the moves of images that came from inside it are undone. The journal is shared
+        # by every input tree, so the history restored from it can hold moves of other trees.
+        history = self.history(action_type)
+        actions = [action for action in history if directory is None or is_inside(action.from_path, directory)]
+        if len(actions) == 0:
+            return []
+
+        # Let queued moves land first, then undo everything in parallel groups
+        self.mover.wait()
+        undone = bulk_undo(actions, self.journal, is_running=lambda: self.is_running)
+        history[:] = [action for action in history if action.status != MoveStatus.UNDONE]
+        logger.info(f"Moved back {len(undone)} files")
+        return undone
+
+    def get_cache(self, args):
+        path = args.cache_path if args.cache_path else default_cache_path()
+        if self.cache is None or self.cache.path != path:
+            if self.cache is not None:
+                self.cache.close()
+            logger.info(f"Using score cache {path}")
+            self.cache = ScoreCache(path, args.cache_max_entries, args.cache_content_hash)
+        self.cache.max_entries = args.cache_max_entries
+        self.cache.use_hash = args.cache_content_hash
+        return self.cache
+
+    def calibration_for(self, args, metrics, path=None):
+        # Calibrates the metrics among metrics that depend on the scoring resolution. With path, the calibration
+        # saved there by an earlier run with the same settings is continued, so a resumed file stays on one scale.
+        metrics = scaled_metrics(metrics)
+        saved = load_calibration(path, args.scoring_resolution, metrics) if path else None
+        return saved if saved is not None else ScoreCalibration(metrics, args.calibration_samples)
+
+    def sharpness_metric(self, args):
+        # The metric sharpness_threshold applies to, and the one calibrated against full resolution. "global"
+        # is the variance of the whole edge image, the tile modes score the sharpest part of the frame.
+        if args.sharpness_mode == "global":
+            return "sharpness"
+        if args.sharpness_mode in ("tile_max", "tile_percentile"):
+            return args.sharpness_mode
+        raise ValueError(f"Unknown sharpness mode {args.sharpness_mode}, expected 'global', 'tile_max' or "
+                         f"'tile_percentile'")
+
+    def tile_options(self, args, tile_map=False):
+        return {"tile_grid": args.tile_grid, "tile_percentile": args.tile_percentile, "tile_map": tile_map}
+
+    def full_scale_record(self, args, path, metrics, cache):
+        # The metrics of path at full resolution, through the cache
+        options = self.tile_options(args)
+        key = quality_key(0, metrics, options=options)
+        record = cache.get_score(path, key)
+        if record is None:
+            record = measure_image(path, 0, metrics, options=options)
+            cache.put_score(path, key, record)
+        return record
+
+    def stats_metrics(self, args):
+        # Sharpness, the metric of the sharpness mode and the configured metrics
+        metrics = parse_metric_names(args.quality_metrics)
+        for name in reversed(["sharpness", self.sharpness_metric(args)]):
+            if name not in metrics:
+                metrics.insert(0, name)
+        return metrics
+
+    def stats_scorer(self, args):
+        # Returns (score, cache key, fields) for statistics records, with the tile map if asked for
+        metrics = self.stats_metrics(args)
+        fields = STATS_FIELDS + [QUALITY_METRICS[name].column for name in metrics if name != "sharpness"]
+        if args.tile_map:
+            fields.append("TileMap")
+        options = self.tile_options(args, args.tile_map)
+        score = partial(measure_image, resolution=args.scoring_resolution, metrics=metrics, options=options)
+        return score, quality_key(args.scoring_resolution, metrics, options=options), fields
+
+    def scoring_settings(self, args):
+        # The settings besides the fields that change the scores in statistics records. A file is only resumed
+        # with the same ones.
+        return {"scoring_resolution": args.scoring_resolution, "calibration_samples": args.calibration_samples,
+                "sharpness_mode": args.sharpness_mode, "tile_grid": args.tile_grid,
+                "tile_percentile": args.tile_percentile}
+
+    def resumable_stats(self, stats_path, fields, settings):
+        path = resumable_path(stats_path, fields, settings)
+        if path != stats_path:
+            logger.info(f"{stats_path} was written with other statistics settings, using {path}")
+        return path
+
+    def filter_rules(self, args):
+        if args.filter_rules:
+            return parse_rules(args.filter_rules)
+        return [[(self.sharpness_metric(args), "<", float(args.sharpness_threshold))]]
+
+    def filter_scorer(self, args, rules, calibration):
+        # Only the metrics the rules mention are computed, and the expensive ones are skipped once a cheaper
+        # one has already matched a rule. The key leaves the rules out, so other thresholds reuse the records.
+        metrics = rule_metrics(rules)
+        options = self.tile_options(args)
+        score = partial(measure_image, resolution=args.scoring_resolution, metrics=metrics,
+                        rules=rules if len(metrics) > 1 else None, options=options, calibration=calibration)
+        return score, quality_key(args.scoring_resolution, metrics, options)
+
+    def completed(self, args, path, record, metrics, key, cache, rules=None, calibration=None):
+        # A cached record can lack the metrics its rules did not need at the time. They are computed unless
+        # rules already decide the image with the values at hand, and the cache entry is completed.
+        missing = missing_metrics(record, metrics)
+        if len(missing) == 0:
+            return record
+        if rules:
+            factor = downscale_factor((record["Width"], record["Height"]), args.scoring_resolution)
+            values = {name: record.get(QUALITY_METRICS[name].column) for name in metrics}
+            if matched_rule(values, rescale_rules(rules, calibration, factor)) is not None:
+                return record
+        try:
+            extra = measure_image(path, args.scoring_resolution, missing, options=self.tile_options(args))
+        except OSError as e:
+            logger.info(f"Could not score {path}: {e}")
+            return record
+        record.update({QUALITY_METRICS[name].column: extra[QUALITY_METRICS[name].column] for name in missing})
+        cache.put_score(path, key, record)
+        return record
+
+    def calibrated(self, args, path, record, calibration, cache):
+        # Moves the scores of a reduced image to the full resolution scale. The first images of every
+        # downscale factor are scored at full resolution as well, they get their exact scores and feed the fit.
+        factor = downscale_factor((record["Width"], record["Height"]), args.scoring_resolution)
+        names = [name for name in calibration.metrics if record.get(QUALITY_METRICS[name].column) is not None]
+        if factor == 1 or len(names) == 0:
+            return record
+        sampled = [name for name in names if calibration.needs_sample(name, factor)]
+        full = self.full_scale_record(args, path, names, cache) if sampled else None
+        for name in names:
+            column = QUALITY_METRICS[name].column
+            if full is None:
+                record[column] = calibration.to_full_scale(name, factor, record[column])
+                continue
+            if name in sampled:
+                calibration.add_sample(name, factor, record[column], full[column])
+            record[column] = full[column]
+        if full is not None:
+            logger.info(f"Scored {path} at full resolution to calibrate downscale factor {factor}")
+        return record
+
+    def apply_rules(self, args, path, record, rules, cache):
+        values = {name: record.get(metric.column) for name, metric in QUALITY_METRICS.items()}
+        group = matched_rule(values, rules)
+        if group is not None:
+            self.filter_move(args, path, cache, format_rule(group))
+        return group
+
+    def relative_selector(self, args):
+        # None for threshold_mode "absolute", where the filter rules decide. "percentile" drops the lowest
+        # drop_percent of the scores, "top" keeps the keep_top sharpest images of every folder.
+        if args.threshold_mode == "absolute":
+            return None
+        if args.filter_rules:
+            raise ValueError(f"filter_rules cannot be combined with threshold_mode {args.threshold_mode}")
+        metric = self.sharpness_metric(args)
+        if args.threshold_mode == "percentile":
+            return PercentileSelector(args.drop_percent, args.decision_buffer, KLLSketch(args.sketch_size), metric)
+        if args.threshold_mode == "top":
+            return TopSelector(args.keep_top, metric)
+        raise ValueError(f"Unknown threshold mode {args.threshold_mode}, expected 'absolute', 'percentile' or 'top'")
+
+    def apply_selection(self, args, decided, cache):
+        for path, reason in decided:
+            self.filter_move(args, path, cache, reason)
+
+    def sketch_of(self, args, records):
+        column = QUALITY_METRICS[self.sharpness_metric(args)].column
+        sketch = KLLSketch(args.sketch_size)
+        for record in records:
+            if record.get(column) is not None:
+                sketch.update(record[column])
+        return sketch
+
+    def merged_sketch(self, args, result_paths):
+        # Shard sketches merge into the sketch of all scores. Results without one are read instead.
+        column = QUALITY_METRICS[self.sharpness_metric(args)].column
+        sketch = KLLSketch(args.sketch_size)
+        for result_path in result_paths:
+            shard_sketch = load_sketch(result_path, column)
+            if shard_sketch is None:
+                logger.info(f"No {column} sketch for {result_path}, reading its scores")
+                shard_sketch = self.sketch_of(args, read_records(result_path))
+            sketch.merge(shard_sketch)
+        return sketch
+
+    def generate_stats(self, args):
+        with instrumented("stats", args.metrics_path, args.profile_path):
+            return self.write_stats(args)
+
+    def write_stats(self, args):
+        images = iter_images(args.input_directory, args.output_directory)
+        output_directory = args.input_directory
+        logger.info(f"Scanning {args.input_directory}")
+        if args.stats_resume:
+            # A fixed name so a restarted run picks up where the last one stopped
+            file_name = f"image_statistics.{args.stats_format}"
+        else:
+            file_name = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_image_statistics.{args.stats_format}"
+        stats_path = os.path.join(output_directory, file_name)
+        score, key, fields = self.stats_scorer(args)
+        settings = self.scoring_settings(args)
+        if args.stats_resume:
+            stats_path = self.resumable_stats(stats_path, fields, settings)
+        writer = StatsWriter(stats_path, args.stats_format, fields, settings=settings)
+        cache = self.get_cache(args)
+        metrics = self.stats_metrics(args)
+        resumed = calibration_path(stats_path) if len(writer.recorded) > 0 else None
+        calibration = self.calibration_for(args, metrics, resumed)
+        if len(writer.recorded) > 0:
+            logger.info(f"Resuming {stats_path}, skipping {len(writer.recorded)} images already recorded")
+            images = (path for path in images if path not in writer.recorded)
+        try:
+            for path, record in score_images(images, args.scoring_workers, lambda: self.is_running, score, cache, key):
+                logger.info(f"Processing {path}")
+                sys.stdout.flush()
+                record = self.completed(args, path, record, metrics, key, cache)
+                writer.write({"File": path, **self.calibrated(args, path, record, calibration, cache)})
+        finally:
+            writer.close()
+            cache.evict()
+            if args.scoring_resolution > 0 and args.stats_resume:
+                save_calibration(calibration_path(stats_path), calibration, args.scoring_resolution)
+        if not self.is_running:
+            logger.info(f"Stopped after {writer.count} images. Statistics so far are in {stats_path}")
+            return stats_path
+
+        logger.info(f"Finished processing {writer.count} images. Statistics file located at {stats_path}")
+        return stats_path
+
+    def filter_blurry(self, args):
+        with instrumented("filter", args.metrics_path, args.profile_path):
+            return self.filter_images(args)
+
+    def filter_images(self, args):
+        images = iter_images(args.input_directory, args.output_directory)
+        logger.info(f"Scanning {args.input_directory}")
+
+        rules = self.filter_rules(args)
+        selector = self.relative_selector(args)
+        cache = self.get_cache(args)
+        metrics = rule_metrics(rules)
+        calibration = self.calibration_for(args, metrics)
+        score, key = self.filter_scorer(args, rules, calibration)
+        columns = [QUALITY_METRICS[name].column for name in metrics]
+        count = 0
+        for path, record in score_images(images, args.scoring_workers, lambda: self.is_running, score, cache, key):
+            count += 1
+            record = self.completed(args, path, record, metrics, key, cache, rules, calibration)
+            record = self.calibrated(args, path, record, calibration, cache)
+            logger.info(f"Path: {path}, " + ", ".join(f"{column}: {record[column]}" for column in columns))
+            if selector is None:
+                self.apply_rules(args, path, record, rules, cache)
+            else:
+                self.apply_selection(args, selector.add(path, record[columns[0]]), cache)
+        if selector is not None and self.is_running:
+            self.apply_selection(args, selector.finish(), cache)
+
+        cache.evict()
+        self.mover.wait()
+        if not self.is_running:
+            logger.info("Stopping filtering.")
+            return count
+        logger.info(f"Finished processing {count} images.")
+        return count
+
+    def watch(self, args, action="filter"):
+        with instrumented(f"watch-{action}", args.metrics_path, args.profile_path):
+            return self.watch_images(args, action)
+
+    def watch_images(self, args, action):
+        # Handles the images already in the tree once, then only what the watcher reports until is_running is
+        # cleared. action "stats" appends to the resumable statistics file, "filter" moves blurry images.
+        if action not in ("filter", "stats"):
+            raise ValueError(f"Unknown watch action {action}, expected 'filter' or 'stats'")
+        watcher = create_watcher(args.input_directory, args.output_directory, args.watch_backend,
+                                 args.watch_interval)
+        cache = self.get_cache(args)
+        writer = None
+        rules = self.filter_rules(args)
+        # Relative thresholds keep their state across batches, images still in the decision buffer when the
+        # watch stops are left in place
+        selector = self.relative_selector(args) if action == "filter" else None
+        column = QUALITY_METRICS[self.sharpness_metric(args)].column
+        seen = {}  # path -> (size, mtime_ns) when it was last scored
+        if action == "stats":
+            metrics = self.stats_metrics(args)
+            calibration = self.calibration_for(args, metrics)
+            score, key, fields = self.stats_scorer(args)
+            settings = self.scoring_settings(args)
+            stats_path = self.resumable_stats(os.path.join(args.input_directory,
+                                                           f"image_statistics.{args.stats_format}"), fields, settings)
+            writer = StatsWriter(stats_path, args.stats_format, fields, settings=settings)
+            for path in writer.recorded:
+                self.changed(path, seen)
+            if len(writer.recorded) > 0:
+                calibration = self.calibration_for(args, metrics, calibration_path(stats_path))
+        else:
+            # The calibration keeps sampling as images of new downscale factors arrive, the scorer sees its fits
+            metrics = rule_metrics(rules)
+            calibration = self.calibration_for(args, metrics)
+            score, key = self.filter_scorer(args, rules, calibration)
+        count = 0
+        # The watcher is set up before the catch up scan, so nothing that arrives meanwhile is missed
+        batch = iter_images(args.input_directory, args.output_directory)
+        logger.info(f"Watching {args.input_directory} with {type(watcher).__name__}")
+        try:
+            while self.is_running:
+                images = [path for path in batch if self.changed(path, seen)]
+                scored = 0
+                for path, record in score_images(images, args.scoring_workers, lambda: self.is_running, score, cache,
+                                                 key):
+                    record = self.completed(args, path, record, metrics, key, cache,
+                                            rules if writer is None else None, calibration)
+                    record = self.calibrated(args, path, record, calibration, cache)
+                    scored += 1
+                    if writer is not None:
+                        writer.write({"File": path, **record})
+                    elif selector is not None:
+                        self.apply_selection(args, selector.add(path, record[column]), cache)
+                    else:
+                        self.apply_rules(args, path, record, rules, cache)
+                if scored > 0:
+                    count += scored
+                    cache.flush()
+                    logger.info(f"Scored {scored} new images, {count} since the watch started")
+                    if args.metrics_path:
+                        try:
+                            METRICS.export(args.metrics_path, f"watch-{action}")
+                        except OSError as e:
+                            logger.info(f"Could not write metrics to {args.metrics_path}: {e}")
+                batch = watcher.poll(1.0)
+        finally:
+            watcher.close()
+            if writer is not None:
+                writer.close()
+                if args.scoring_resolution > 0:
+                    save_calibration(calibration_path(stats_path), calibration, args.scoring_resolution)
+            cache.evict()
+            self.mover.wait()
+        logger.info(f"Stopped watching {args.input_directory} after {count} images")
+        return count
+
+    def changed(self, path, seen):
+        # True the first time a file is seen and whenever its size or mtime changed since then
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False  # Moved away or deleted before it could be scored
+        identity = (stat.st_size, stat.st_mtime_ns)
+        if seen.get(path) == identity:
+            return False
+        seen[path] = identity
+        return True
+
+    def group_bursts(self, args, images):
+        # Groups near-duplicate images by perceptual hash and ranks every group sharpest first. Only members
+        # of groups with more than one image are scored, singletons need no ranking.
+        cache = self.get_cache(args)
+        keys = [(path, key["hash"], key["time"]) for path, key in
+                score_images(images, args.scoring_workers, lambda: self.is_running, burst_key, cache, "burst")]
+        groups = find_groups(keys, args.burst_distance, args.burst_window)
+        members = [path for group in groups if len(group) > 1 for path in group]
+        score = partial(score_image, resolution=args.scoring_resolution)
+        key = f"image@{args.scoring_resolution}"
+        sharpness = {path: record["Sharpness"] for path, record in
+                     score_images(members, args.scoring_workers, lambda: self.is_running, score, cache, key)}
+        cache.flush()
+        if not self.is_running:
+            return []
+        # Members that could not be read are left out of their group
+        groups = [[path for path in group if len(group) == 1 or path in sharpness] for group in groups]
+        groups = [group for group in groups if len(group) > 0]
+        logger.info(f"Grouped {len(keys)} images into {len(groups)} groups, "
+                    f"{sum(1 for group in groups if len(group) > 1)} of them bursts")
+        return [rank_group(group, sharpness) if len(group) > 1 else group for group in groups]
+
+    def write_manifests(self, args, shards, manifest_directory):
+        # The calibration is sampled here from the first images and shipped with the manifests, so the shards
+        # share one scale for their downscale factors. A factor none of them has is sampled by the shards.
+        images = iter_images(args.input_directory, args.output_directory)
+        logger.info(f"Scanning {args.input_directory}")
+        os.makedirs(manifest_directory, exist_ok=True)
+        if args.scoring_resolution > 0:
+            head = list(islice(images, args.calibration_samples))
+            calibration = self.calibration_for(args, self.stats_metrics(args))
+            cache = self.get_cache(args)
+            options = self.tile_options(args)
+            score = partial(measure_image, resolution=args.scoring_resolution, metrics=calibration.metrics,
+                            options=options)
+            key = quality_key(args.scoring_resolution, calibration.metrics, options=options)
+            for path, record in score_images(head, args.scoring_workers, lambda: self.is_running, score, cache, key):
+                self.calibrated(args, path, record, calibration, cache)
+            cache.flush()
+            save_calibration(os.path.join(manifest_directory, CALIBRATION_FILE), calibration, args.scoring_resolution)
+            images = chain(head, images)
+        paths = write_manifests(images, args.input_directory, shards, manifest_directory)
+        logger.info(f"Wrote {len(paths)} manifests to {manifest_directory}")
+        return paths
+
+    def score_manifest(self, args, manifest_path, result_path):
+        with instrumented("score-shard", args.metrics_path, args.profile_path):
+            return self.score_shard(args, manifest_path, result_path)
+
+    def score_shard(self, args, manifest_path, result_path):
+        # Scores one shard into a result file keyed by relative path. Re-running a shard resumes it.
+        metrics = self.stats_metrics(args)
+        calibration = self.calibration_for(args, metrics)
+        if args.scoring_resolution > 0:
+            shipped = os.path.join(os.path.dirname(manifest_path), CALIBRATION_FILE)
+            if load_calibration(shipped, args.scoring_resolution, calibration.metrics) is None:
+                raise ValueError(f"{manifest_path} has no calibration of {', '.join(calibration.metrics)} for a "
+                                 f"scoring resolution of {args.scoring_resolution}, write the manifests with the same "
+                                 f"settings")
+            # A resumed shard continues its own copy, which started from the shipped one
+            own = calibration_path(result_path)
+            calibration = self.calibration_for(args, calibration.metrics, own if os.path.exists(own) else shipped)
+        score, key, fields = self.stats_scorer(args)
+        writer = StatsWriter(result_path, format_for(result_path), fields, settings=self.scoring_settings(args))
+        images = (path for path in read_manifest(manifest_path, args.input_directory)
+                  if relative_key(path, args.input_directory) not in writer.recorded)
+        if len(writer.recorded) > 0:
+            logger.info(f"Resuming {result_path}, skipping {len(writer.recorded)} images already recorded")
+        cache = self.get_cache(args)
+        try:
+            for path, record in score_images(images, args.scoring_workers, lambda: self.is_running, score, cache, key):
+                logger.info(f"Processing {path}")
+                record = self.completed(args, path, record, metrics, key, cache)
+                record = self.calibrated(args, path, record, calibration, cache)
+                writer.write({"File": relative_key(path, args.input_directory), **record})
+        finally:
+            writer.close()
+            cache.evict()
+            if args.scoring_resolution > 0:
+                save_calibration(calibration_path(result_path), calibration, args.scoring_resolution)
+        # For relative thresholds at merge time, covering the records of earlier runs of this shard as well
+        save_sketch(result_path, self.sketch_of(args, read_records(result_path)),
+                    QUALITY_METRICS[self.sharpness_metric(args)].column)
+        logger.info(f"Scored {writer.count} images of {manifest_path} into {result_path}")
+        return writer.count
+
+    def merge_shards(self, args, result_paths, output_path, decisions=False, apply=False):
+        # Combines shard results into one statistics file. With decisions every record gets a keep/blurry
+        # Decision from the filter rules or the relative threshold, with apply the blurry ones are also moved.
+        if any(same_path(path, output_path) for path in result_paths):
+            raise ValueError(f"{output_path} is one of the results to merge, write the merge to another file")
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        _, _, fields = self.stats_scorer(args)
+        rules = self.filter_rules(args)
+        kept = None  # With threshold_mode "top", the relative paths that make the top of their folder
+        metric = self.sharpness_metric(args)
+        if decisions and self.relative_selector(args) is not None:
+            if args.threshold_mode == "percentile":
+                sketch = self.merged_sketch(args, result_paths)
+                threshold = sketch.quantile(args.drop_percent / 100)
+                rules = [[(metric, "<=", threshold)]] if threshold is not None else []
+                if threshold is not None:
+                    logger.info(f"The lowest {args.drop_percent}% of {sketch.count} images: {metric} <= {threshold:g}")
+            else:
+                kept = self.top_of_folders(args, result_paths)
+        if decisions:
+            fields = fields + ["Decision"]
+        writer = StatsWriter(output_path, format_for(output_path), fields)
+        cache = self.get_cache(args) if apply else None
+        blurry = 0
+        try:
+            for record in merge_results(result_paths):
+                if not self.is_running:
+                    break
+                key = record["File"]
+                path = os.path.join(args.input_directory, *key.split("/"))
+                record["File"] = path
+                if decisions:
+                    if kept is not None:
+                        reason = None if key in kept else f"{metric} below the top {args.keep_top} of its folder"
+                    else:
+                        values = {name: record.get(metric.column) for name, metric in QUALITY_METRICS.items()}
+                        missing = [name for name in rule_metrics(rules)
+                                   if QUALITY_METRICS[name].column not in record]
+                        if missing:
+                            raise ValueError(f"The shard results have no {', '.join(missing)}, score them with "
+                                             f"quality_metrics including it to use these filter rules")
+                        group = matched_rule(values, rules)
+                        reason = format_rule(group) if group is not None else None
+                    record["Decision"] = "blurry" if reason is not None else "keep"
+                    if reason is not None:
+                        blurry += 1
+                        if apply:
+                            self.filter_move(args, path, cache, reason)
+                writer.write(record)
+        finally:
+            writer.close()
+        self.mover.wait()
+        logger.info(f"Merged {writer.count} records from {len(result_paths)} results into {output_path}")
+        if decisions:
+            logger.info(f"{blurry} images are blurry")
+        return writer.count
+
+    def top_of_folders(self, args, result_paths):
+        # A first pass over the merged results, only the top of every folder is kept in memory
+        metric = self.sharpness_metric(args)
+        column = QUALITY_METRICS[metric].column
+        selector = TopSelector(args.keep_top, metric)
+        for record in merge_results(result_paths):
+            if column not in record:
+                raise ValueError(f"The shard results have no {metric}, score them with the same sharpness_mode")
+            if record[column] is not None:
+                selector.add(record["File"], record[column])
+        return {path for heap in selector.heaps.values() for _, _, path in heap}
+
+    def filter_move(self, args, path, cache, reason=None):
+        blurry_directory = self.get_blurry_directory(args, path)
+        if reason is None:
+            reason = f"sharpness < {args.sharpness_threshold}"
+        logger.info(f"{path} matches {reason}. Moving to {blurry_directory}")
+        action = MoveAction(path, os.path.join(blurry_directory, os.path.basename(path)), MoveActionType.FILTER, cache)
+        self.filter_history.append(action)
+        self.mover.submit(action)
+        if self.on_filter_move is not None:
+            self.on_filter_move(action)
+        return action
+
+    def get_blurry_directory(self, args, source_file):
+        blurry_directory = self.get_output(args, source_file, ".too_blurry")
+        return blurry_directory
+
+    def get_output(self, args, source_file, prefix=None):
+        output_directory = args.output_directory if args.output_directory else args.input_directory
+        diff = get_path_diff(args.input_directory, os.path.dirname(source_file))
+        if prefix is not None:
+            output_directory = os.path.join(output_directory, prefix, diff)
+        else:
+            output_directory = os.path.join(output_directory, diff)
+        return output_directory
+
+    def handle_group_selection(self, group, choice, args):
+        for f in group:
+            self.handle_user_selection(f, choice, args)
+
+    def handle_user_selection(self, f, choice, args):
+        out = self.yes_dir if choice == "y" else self.no_dir if choice == "n" else self.maybe_dir
+        output_directory = self.get_output(args, f, prefix=out)
+        action = MoveAction(f, os.path.join(output_directory, os.path.basename(f)), MoveActionType.SELECT,
+                            self.get_cache(args))
+        self.select_history.append(action)
+        self.mover.submit(action)
+
+    def close(self):
+        self.mover.wait()
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
+        self.journal.close()
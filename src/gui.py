@@ -0,0 +1,302 @@
+import logging
+from datetime import datetime
+import tkinter as tk
+import os
+from argparse import Namespace
+from tkinter import scrolledtext, messagebox, Toplevel, Label, Entry, Button
+import threading
+import sys
+
+# Only Tk and light modules here, the imaging and scoring stack is imported once the window is up
+from actions import MoveActionType
+from defaults import DEFAULT_SETTINGS
+from log_sink import QueueLogSink
+from logs import file_handler
+from instrumentation import METRICS
+
+log_filename = f"finwave_pipeline_image_extraction_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
+
+# Configure log to file and stdout
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.StreamHandler()
+    ]
+)
+
+logger = logging.getLogger("sortr")
+
+STARTUP_PROBE = "SORTR_STARTUP_PROBE"  # Set by benchmark.py --startup to time the launch
+
+
+settings = dict(DEFAULT_SETTINGS)
+
+
+class SortrGUI:
+    def __init__(self, root):
+        self.root = root
+        self.root.title("Sortr")
+        self.root.geometry("400x600")
+
+        self.log_display = scrolledtext.ScrolledText(root, state='disabled', height=15)
+        self.log_display.pack(pady=10, padx=10, fill=tk.BOTH, expand=True)
+
+        self.loaded_engine = None  # Loaded on a background thread once the window is up, see engine
+        self.engine_lock = threading.Lock()
+        self.thread = None  # To hold the pipeline thread
+        self.review = None  # Review session, driven by Tk callbacks
+
+        self.settings_button = tk.Button(root, text="Settings", command=self.open_settings)
+        self.settings_button.pack(pady=5)
+
+        self.start_button = tk.Button(root, text="Start", command=self.toggle_pipeline)
+        self.start_button.pack(pady=5)
+
+        self.filter_button = tk.Button(root, text="Filter Blurry", command=self.toggle_filter_blurry)
+        self.filter_button.pack(pady=5)
+
+        self.stats_button = tk.Button(root, text="Generate Photo Statistics", command=self.toggle_stats_generation)
+        self.stats_button.pack(pady=5)
+
+        self.watch_button = tk.Button(root, text="Watch Input Folder", command=self.toggle_watch)
+        self.watch_button.pack(pady=5)
+
+        self.undo_filter_button = None
+
+        self.status_label = tk.Label(root, text="", anchor='w', justify=tk.LEFT, wraplength=380)
+        self.status_label.pack(pady=5, padx=10, fill=tk.X)
+        self.update_status()
+
+        # Redirect log to the GUI
+        self.setup_logging()
+        self.root.after_idle(lambda: threading.Thread(target=self.load_engine, daemon=True).start())
+        self.wait_for_engine()
+
+    def load_engine(self):
+        with self.engine_lock:
+            if self.loaded_engine is None:
+                from engine import SortrEngine
+                engine = SortrEngine(settings["journal_path"], settings["move_copy_workers"])
+                # Called on the filter thread, widgets are only touched on the Tk thread
+                engine.on_filter_move = lambda action: self.root.after(0, self.add_undo_filter_button)
+                engine.recover_moves(Namespace(**settings))
+                self.loaded_engine = engine
+        return self.loaded_engine
+
+    @property
+    def engine(self):
+        # Used before the background load finished, this waits for it
+        if self.loaded_engine is None:
+            return self.load_engine()
+        return self.loaded_engine
+
+    def wait_for_engine(self):
+        if self.loaded_engine is None:
+            self.root.after(50, self.wait_for_engine)
+            return
+        if len(self.loaded_engine.filter_history) > 0:
+            self.add_undo_filter_button()
+
+    @property
+    def is_running(self):
+        return self.loaded_engine is not None and self.loaded_engine.is_running
+
+    @is_running.setter
+    def is_running(self, value):
+        self.engine.is_running = value
+
+    def update_status(self):
+        if self.loaded_engine is None:
+            self.status_label.config(text="Loading...")
+            self.root.after(100, self.update_status)
+            return
+        mover = self.loaded_engine.mover
+        status = f"Moves: {mover.pending()} pending, {mover.completed} done, {len(mover.failures)} failed"
+        if self.is_running:
+            status += "\n" + METRICS.summary()
+        self.status_label.config(text=status)
+        self.root.after(500, self.update_status)
+
+    def undo_all(self, action_type: MoveActionType):
+        # Runs on the thread of toggle_undo_filter, the button is reset on the Tk thread
+        self.engine.undo_all(action_type, settings["input_directory"])
+        self.is_running = False
+        self.root.after(0, lambda: self.start_button.config(text="Start"))
+
+    def toggle_stats_generation(self):
+        if not self.is_running:
+            logger.info("Starting statistics generation")
+            self.is_running = True
+            self.start_button.config(text="Stop")  # Change button text to Stop
+            self.thread = threading.Thread(target=self.generate_stats)
+            self.thread.start()
+
+        else:
+            self.is_running = False
+
+    def toggle_filter_blurry(self):
+        if not self.is_running:
+            logger.info("Starting to filter blurry images")
+            self.is_running = True
+            self.start_button.config(text="Stop")  # Change button text to Stop
+            self.thread = threading.Thread(target=self.filter_blurry)
+            self.thread.start()
+        else:
+            self.is_running = False
+
+    def toggle_watch(self):
+        if not self.is_running:
+            logger.info(f"Watching for new images ({settings['watch_action']})")
+            self.is_running = True
+            self.start_button.config(text="Stop")  # Change button text to Stop
+            self.thread = threading.Thread(target=self.watch)
+            self.thread.start()
+        else:
+            self.is_running = False
+
+    def watch(self):
+        try:
+            self.engine.watch(self.run_args(), settings["watch_action"])
+        except (OSError, ValueError) as e:
+            logger.info(f"Watching failed: {e}")
+
+    def run_args(self):
+        args = Namespace(**settings)
+        settings["profile_path"] = ""  # Profiling is switched on for a single run
+        return args
+
+    def generate_stats(self):
+        try:
+            self.engine.generate_stats(self.run_args())
+        except (OSError, ValueError) as e:
+            logger.info(f"Statistics generation failed: {e}")
+
+    def filter_blurry(self):
+        try:
+            self.engine.filter_blurry(self.run_args())
+        except (OSError, ValueError) as e:
+            logger.info(f"Filtering failed: {e}")
+
+    def toggle_undo_filter(self):
+        if not self.is_running:
+            logger.info("Undoing filtering opterations...")
+            self.is_running = True
+            self.start_button.config(text="Stop")  # Change button text to Stop
+            self.thread = threading.Thread(target=self.undo_all, args=[MoveActionType.FILTER])
+            self.thread.start()
+
+        else:
+            self.is_running = False
+
+    def add_undo_filter_button(self):
+        if self.undo_filter_button is not None:
+            return
+        self.undo_filter_button = tk.Button(self.root, text="Undo filtering", command=self.toggle_undo_filter)
+        self.undo_filter_button.pack(pady=5)
+
+    def toggle_pipeline(self):
+        if not self.is_running:
+            logger.info("Starting pipeline")
+            self.is_running = True
+            self.start_button.config(text="Stop")  # Change button text to Stop
+            self.start_pipeline()
+        else:
+            logger.info("Stopping pipeline")
+            self.is_running = False
+            self.start_button.config(text="Start Pipeline")  # Change button text back to Start
+            if self.review is not None:
+                self.review.close()
+
+    def start_pipeline(self):
+        logger.info(f"Starting pipeline with settings: {settings}")
+        if settings["review_mode"] == "grid":
+            from contact_sheet import GridReviewController
+            self.review = GridReviewController(self, self.run_args())
+        else:
+            from review import ReviewController
+            self.review = ReviewController(self, self.run_args())
+        self.review.start()
+
+    def review_finished(self):
+        self.review = None
+        self.is_running = False
+        self.start_button.config(text="Start")
+
+    def setup_logging(self):
+        # One handler for the GUI, worker threads only enqueue and the Tk thread drains in batches
+        self.log_handler = QueueLogSink(self.log_display, settings["log_max_lines"])
+        logger.addHandler(self.log_handler)
+        self.log_handler.start()
+        if settings["log_to_file"]:
+            logger.addHandler(file_handler(log_filename))
+        logger.propagate = False
+
+    def open_settings(self):
+        settings_window = Toplevel(self.root)
+        settings_window.title("Settings")
+        settings_window.geometry("600x600")
+
+        # There are more settings than fit the window, they scroll while Save stays at the bottom
+        button_frame = tk.Frame(settings_window)
+        button_frame.pack(side=tk.BOTTOM, fill=tk.X)
+        canvas = tk.Canvas(settings_window, highlightthickness=0)
+        scrollbar = tk.Scrollbar(settings_window, orient=tk.VERTICAL, command=canvas.yview)
+        canvas.configure(yscrollcommand=scrollbar.set)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        form = tk.Frame(canvas)
+        canvas.create_window((0, 0), window=form, anchor='nw')
+        form.bind('<Configure>', lambda event: canvas.configure(scrollregion=canvas.bbox('all')))
+
+        def on_mouse_wheel(event):
+            if event.num == 4 or event.delta > 0:
+                canvas.yview_scroll(-1, 'units')
+            elif event.num == 5 or event.delta < 0:
+                canvas.yview_scroll(1, 'units')
+
+        # Bound on the window, so the wheel scrolls wherever the pointer is inside it
+        settings_window.bind('<MouseWheel>', on_mouse_wheel)
+        settings_window.bind('<Button-4>', on_mouse_wheel)
+        settings_window.bind('<Button-5>', on_mouse_wheel)
+
+        entries = {}
+
+        for i, (key, value) in enumerate(settings.items()):
+            Label(form, text=key).grid(row=i, column=0, padx=10, pady=5, sticky='w')
+            entry = Entry(form)
+            entry.insert(0, str(value))
+            entry.grid(row=i, column=1, padx=10, pady=5)
+            entries[key] = entry
+
+        def save_settings():
+            logger.info("Saving settings")
+            for key, entry in entries.items():
+                new_value = entry.get()
+                if isinstance(settings[key], bool):
+                    settings[key] = new_value.lower() in ('true', '1', 'yes')
+                elif isinstance(settings[key], int):
+                    try:
+                        settings[key] = int(new_value)
+                    except ValueError:
+                        messagebox.showerror("Invalid input", f"{key} must be an integer")
+                        return
+                else:
+                    settings[key] = new_value
+            settings_window.destroy()
+
+        Button(button_frame, text="Save", command=save_settings).pack(pady=10)
+
+
+def main():
+    root = tk.Tk()
+    app = SortrGUI(root)
+    if os.environ.get(STARTUP_PROBE):
+        # Reports when the first frame is drawn and when the engine is usable, then quits
+        root.update()
+        print("startup: first_window", flush=True)
+        app.engine
+        print("startup: engine_ready", flush=True)
+        root.destroy()
+        sys.exit(0)
+    root.mainloop()
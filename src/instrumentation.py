@@ -0,0 +1,200 @@
+import cProfile
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger("sortr.instrumentation")
+
+
+class Metrics:
+    # Per-stage timers, counters and gauges for the current run. Safe to update from any thread. Worker
+    # processes record into their own instance and hand it back with drain(), the caller merge()s it, so
+    # stage times are summed over all workers and can add up to more than the wall clock time.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.perf_counter()
+            self.stages = {}  # name -> [calls, total seconds, longest call]
+            self.counters = {}
+            self.gauges = {}
+
+    def after_fork(self):
+        # A forked worker may inherit the lock held by a thread that does not exist in the child
+        self.lock = threading.Lock()
+        self.reset()
+
+    def observe(self, name, seconds):
+        with self.lock:
+            entry = self.stages.get(name)
+            if entry is None:
+                self.stages[name] = [1, seconds, seconds]
+            else:
+                entry[0] += 1
+                entry[1] += seconds
+                entry[2] = max(entry[2], seconds)
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def gauge(self, name, value):
+        with self.lock:
+            self.gauges[name] = value
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def drain(self):
+        with self.lock:
+            drained = (self.stages, self.counters)
+            self.stages, self.counters = {}, {}
+        return drained
+
+    def merge(self, drained):
+        stages, counters = drained
+        with self.lock:
+            for name, (calls, total, longest) in stages.items():
+                entry = self.stages.setdefault(name, [0, 0.0, 0.0])
+                entry[0] += calls
+                entry[1] += total
+                entry[2] = max(entry[2], longest)
+            for name, amount in counters.items():
+                self.counters[name] = self.counters.get(name, 0) + amount
+
+    def snapshot(self):
+        with self.lock:
+            elapsed = time.perf_counter() - self.started
+            images = self.counters.get("images", 0)
+            return {
+                "elapsed_seconds": elapsed,
+                "images_per_second": images / elapsed if elapsed > 0 else 0.0,
+                "stages": {name: {"calls": calls, "seconds": total, "max_seconds": longest,
+                                  "mean_seconds": total / calls}
+                           for name, (calls, total, longest) in self.stages.items()},
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+            }
+
+    def summary(self):
+        # One line for the status area: throughput, the slowest stages and the cache hit rate
+        snapshot = self.snapshot()
+        counters = snapshot["counters"]
+        parts = [f"{counters.get('images', 0)} images, {snapshot['images_per_second']:.1f}/s"]
+        slowest = sorted(snapshot["stages"].items(), key=lambda item: -item[1]["seconds"])[:4]
+        if slowest:
+            parts.append(", ".join(f"{name} {stage['seconds']:.1f}s" for name, stage in slowest))
+        lookups = counters.get("cache_hits", 0) + counters.get("cache_misses", 0)
+        if lookups > 0:
+            parts.append(f"cache {counters.get('cache_hits', 0) * 100 // lookups}% hits")
+        if counters.get("bytes_read", 0) > 0:
+            parts.append(f"{counters['bytes_read'] / (1024 * 1024):.0f} MiB read")
+        return " | ".join(parts)
+
+    def to_prometheus(self, run=""):
+        snapshot = self.snapshot()
+        label = f'run="{run}"'
+        lines = [
+            "# TYPE sortr_elapsed_seconds gauge",
+            f"sortr_elapsed_seconds{{{label}}} {snapshot['elapsed_seconds']}",
+            "# TYPE sortr_images_per_second gauge",
+            f"sortr_images_per_second{{{label}}} {snapshot['images_per_second']}",
+            "# TYPE sortr_stage_seconds_total counter",
+        ]
+        for name, stage in snapshot["stages"].items():
+            lines.append(f'sortr_stage_seconds_total{{{label},stage="{name}"}} {stage["seconds"]}')
+        lines.append("# TYPE sortr_stage_calls_total counter")
+        for name, stage in snapshot["stages"].items():
+            lines.append(f'sortr_stage_calls_total{{{label},stage="{name}"}} {stage["calls"]}')
+        for name, value in snapshot["counters"].items():
+            lines.append(f"# TYPE sortr_{name}_total counter")
+            lines.append(f"sortr_{name}_total{{{label}}} {value}")
+        for name, value in snapshot["gauges"].items():
+            lines.append(f"# TYPE sortr_{name} gauge")
+            lines.append(f"sortr_{name}{{{label}}} {value}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, path, run=""):
+        # Prometheus text format for .prom and .txt files, a JSON summary otherwise
+        if path.lower().endswith((".prom", ".txt")):
+            text = self.to_prometheus(run)
+        else:
+            text = json.dumps({"run": run, **self.snapshot()}, indent=2) + "\n"
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        temporary = path + ".tmp"
+        with open(temporary, "w") as f:
+            f.write(text)
+        os.replace(temporary, path)
+
+
+METRICS = Metrics()
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=METRICS.after_fork)
+
+
+def stage(name):
+    return METRICS.stage(name)
+
+
+def count(name, amount=1):
+    METRICS.count(name, amount)
+
+
+def gauge(name, value):
+    METRICS.gauge(name, value)
+
+
+def measured(score, path):
+    # Runs in a worker process, returns the score together with what was recorded while computing it
+    value = score(path)
+    return value, METRICS.drain()
+
+
+def start_profile(path):
+    # cProfile only sees the thread it is started on, worker processes and threads are not included
+    if not path:
+        return None
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def stop_profile(profiler, path):
+    if profiler is None:
+        return
+    profiler.disable()
+    profiler.dump_stats(path)
+    logger.info(f"Profile written to {path}, view it with: python -m pstats {path}")
+
+
+@contextmanager
+def instrumented(run, metrics_path="", profile_path=""):
+    # Fresh metrics for one filter or statistics run, exported and summarised when it ends
+    METRICS.reset()
+    profiler = start_profile(profile_path)
+    try:
+        yield METRICS
+    finally:
+        stop_profile(profiler, profile_path)
+        finish(run, metrics_path)
+
+
+def finish(run, metrics_path=""):
+    logger.info(f"{run}: {METRICS.summary()}")
+    if metrics_path:
+        try:
+            METRICS.export(metrics_path, run)
+            logger.info(f"Metrics written to {metrics_path}")
+        except OSError as e:
+            logger.info(f"Could not write metrics to {metrics_path}: {e}")
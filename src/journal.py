@@ -0,0 +1,227 @@
+import json
+import logging
+import os
+import threading
+import uuid
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from actions import MoveAction, MoveActionType
+from cache import default_cache_path
+from mover import MoveStatus, PARTIAL_SUFFIX
+
+logger = logging.getLogger("sortr.journal")
+
+MOVE = "move"
+UNDO = "undo"
+
+
+def default_journal_path():
+    return os.path.join(os.path.dirname(default_cache_path()), "moves.journal")
+
+
+def lock_file(f, blocking=True):
+    # Exclusive lock between processes on an open file. Without blocking, False if another one holds it.
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+    except OSError:
+        if blocking:
+            raise
+        return False
+    return True
+
+
+def unlock_file(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class MoveJournal:
+    # Append-only JSON Lines log of every move. A "begin" record is fsynced before the file is touched and a
+    # "commit" record follows once it is in place, so after a crash every move is either provably finished,
+    # provably not started, or can be resolved by looking at which of the two paths exists.
+    # The GUI and the command line can share one journal: appends and compaction hold a lock file, and every
+    # instance holds the lock of its own session file while it is open, so recovery leaves the moves that a
+    # running session still has in flight alone.
+    def __init__(self, path=None):
+        self.path = path if path else default_journal_path()
+        self.lock = threading.Lock()
+        self.lock_path = self.path + ".lock"
+        self.session_directory = self.path + ".sessions"
+        self.session = uuid.uuid4().hex
+        os.makedirs(self.session_directory, exist_ok=True)
+        self.session_file = open(os.path.join(self.session_directory, self.session), "a+")
+        lock_file(self.session_file)
+
+    @contextmanager
+    def locked(self):
+        with self.lock, open(self.lock_path, "a+") as f:
+            lock_file(f)
+            try:
+                yield
+            finally:
+                unlock_file(f)
+
+    def write(self, record, sync=False):
+        # Opened per record, a compaction by another process replaces the file
+        with self.locked(), open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            if sync:
+                os.fsync(f.fileno())
+
+    def begin(self, action, reverse=False):
+        if getattr(action, "journal_id", None) is None:
+            action.journal_id = uuid.uuid4().hex
+        self.write({
+            "id": action.journal_id,
+            "event": "begin",
+            "direction": UNDO if reverse else MOVE,
+            "from": action.from_path,
+            "to": action.to_path,
+            "type": action.action_type.name,
+            "session": self.session,
+        }, sync=True)
+
+    def commit(self, action, reverse=False):
+        # Not fsynced, a lost commit is recovered from the file system state
+        self.write({"id": action.journal_id, "event": "commit", "direction": UNDO if reverse else MOVE})
+
+    def read(self):
+        entries = {}  # id -> state, in first seen order
+        if not os.path.exists(self.path):
+            return entries
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A torn last line from a crash mid-write
+                    continue
+                entry = entries.setdefault(record["id"], {"committed": None, "pending": None})
+                if record["event"] == "begin":
+                    entry.update({"from": record["from"], "to": record["to"], "type": record["type"],
+                                  "session": record.get("session")})
+                    entry["pending"] = record["direction"]
+                else:
+                    entry["committed"] = record["direction"]
+                    entry["pending"] = None
+        return entries
+
+    def recover(self, cache=None):
+        # Finishes or rolls back moves that were interrupted and returns the moves that are still applied,
+        # oldest first, so they can be undone after a restart. The journal is compacted to just those plus
+        # the moves other running sessions have in flight. cache is given to the returned actions.
+        with self.locked():
+            entries = self.read()
+            live = []
+            running = []
+            for journal_id, entry in entries.items():
+                if "from" not in entry:
+                    continue  # A commit whose begin was lost
+                if entry["pending"] is not None:
+                    if self.running(entry["session"]):
+                        running.append((journal_id, entry))
+                        continue
+                    if entry["pending"] == MOVE:
+                        source, target = entry["from"], entry["to"]
+                    else:
+                        source, target = entry["to"], entry["from"]
+                    if resolve(source, target):
+                        entry["committed"] = entry["pending"]
+                        logger.info(f"Recovered interrupted {entry['pending']} of {source} to {target}")
+                    else:
+                        logger.info(f"Rolled back interrupted {entry['pending']} of {source} to {target}")
+                if entry["committed"] == MOVE:
+                    action = MoveAction(entry["from"], entry["to"], MoveActionType[entry["type"]], cache)
+                    action.journal_id = journal_id
+                    action.status = MoveStatus.DONE
+                    live.append(action)
+            self.rewrite(live, running)
+            self.forget_sessions()
+        return live
+
+    def running(self, session):
+        # True while the session that wrote a record still has its session file locked
+        if session is None:
+            return False
+        path = os.path.join(self.session_directory, session)
+        if not os.path.exists(path):
+            return False
+        with open(path, "a+") as f:
+            if not lock_file(f, blocking=False):
+                return True
+            unlock_file(f)
+        return False
+
+    def forget_sessions(self):
+        # Session files of processes that ended without closing their journal
+        for name in os.listdir(self.session_directory):
+            if name != self.session and not self.running(name):
+                try:
+                    os.remove(os.path.join(self.session_directory, name))
+                except OSError:
+                    pass
+
+    def compact(self, actions):
+        # Rewrites the journal to just actions, all applied moves
+        with self.locked():
+            self.rewrite(actions)
+
+    def rewrite(self, actions, running=()):
+        temporary = self.path + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            records = []
+            for action in actions:
+                records.append({"id": action.journal_id, "event": "begin", "direction": MOVE,
+                                "from": action.from_path, "to": action.to_path, "type": action.action_type.name})
+                records.append({"id": action.journal_id, "event": "commit", "direction": MOVE})
+            for journal_id, entry in running:
+                begin = {"id": journal_id, "event": "begin", "from": entry["from"], "to": entry["to"],
+                         "type": entry["type"], "session": entry["session"]}
+                if entry["committed"] == MOVE:
+                    records.append(dict(begin, direction=MOVE))
+                    records.append({"id": journal_id, "event": "commit", "direction": MOVE})
+                records.append(dict(begin, direction=entry["pending"]))
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.path)
+
+    def close(self):
+        with self.lock:
+            if self.session_file.closed:
+                return
+            unlock_file(self.session_file)
+            self.session_file.close()
+            try:
+                os.remove(self.session_file.name)
+            except OSError:
+                pass
+
+
+def resolve(source, target):
+    # Returns True if an interrupted move from source to target ended up (or was completed) at target
+    if os.path.exists(target):
+        if os.path.exists(source):
+            # Copied across devices but the source was not unlinked yet. The copy is only renamed into
+            # place once complete, so the target is whole
+            os.unlink(source)
+        return True
+    partial_target = target + PARTIAL_SUFFIX
+    if os.path.exists(partial_target):
+        os.unlink(partial_target)
+    return False
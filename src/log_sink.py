@@ -0,0 +1,48 @@
+import logging
+import tkinter as tk
+from collections import deque
+
+from logs import LOG_FORMAT
+
+
+class QueueLogSink(logging.Handler):
+    # Log handler that is safe to call from any thread: emit only formats and enqueues the line. The Tk
+    # thread drains the queue in batches into a text widget that keeps at most max_lines of scrollback.
+    def __init__(self, widget, max_lines=5000, interval=100):
+        super().__init__()
+        self.widget = widget
+        self.max_lines = max_lines
+        self.interval = interval
+        # Bounded as well, anything older than max_lines would be trimmed from the widget anyway
+        self.pending = deque(maxlen=max_lines)
+        self.setFormatter(logging.Formatter(LOG_FORMAT))
+        self.drain_job = None
+
+    def emit(self, record):
+        try:
+            self.pending.append(self.format(record))
+        except Exception:
+            self.handleError(record)
+
+    def start(self):
+        self.drain_job = self.widget.after(self.interval, self.drain)
+
+    def stop(self):
+        if self.drain_job is not None:
+            self.widget.after_cancel(self.drain_job)
+            self.drain_job = None
+
+    def drain(self):
+        lines = []
+        while len(self.pending) > 0:
+            lines.append(self.pending.popleft())
+        if len(lines) > 0:
+            self.widget.config(state=tk.NORMAL)  # Make the widget editable temporarily
+            self.widget.insert(tk.END, "\n".join(lines) + "\n")
+            line_count = int(self.widget.index("end-1c").split(".")[0]) - 1
+            if line_count > self.max_lines:
+                self.widget.delete("1.0", f"{line_count - self.max_lines + 1}.0")
+            self.widget.config(state=tk.DISABLED)  # Make the widget read-only again
+            self.widget.yview(tk.END)  # Scroll to the end of the text widget
+        self.drain_job = self.widget.after(self.interval, self.drain)
+
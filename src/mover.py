@@ -0,0 +1,226 @@
+import logging
+import os
+import shutil
+import threading
+from collections import deque, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+
+from instrumentation import METRICS, stage
+
+logger = logging.getLogger("sortr.mover")
+
+PARTIAL_SUFFIX = ".sortr-partial"
+
+
+class MoveStatus(Enum):
+    PENDING = 1
+    DONE = 2
+    FAILED = 3
+    CANCELLED = 4
+    UNDONE = 5
+
+
+def same_device(source, target_directory):
+    return os.stat(source).st_dev == os.stat(target_directory).st_dev
+
+
+def copy_then_unlink(source, target):
+    # Copies next to the target first so a crash never leaves a truncated file under the final name
+    partial_target = target + PARTIAL_SUFFIX
+    with stage("copy"):
+        shutil.copy2(source, partial_target)
+        os.replace(partial_target, target)
+        os.unlink(source)
+
+
+def prepare_target(target, created_directories):
+    directory = os.path.dirname(target)
+    if directory not in created_directories:
+        os.makedirs(directory, exist_ok=True)
+        created_directories.add(directory)
+    if os.path.exists(target):
+        raise FileExistsError(f"Destination path '{target}' already exists")
+    return directory
+
+
+def undo_move(action, journal=None, created_directories=None):
+    # Synchronous counterpart of MoveExecutor.undo for actions that are no longer queued
+    if os.path.exists(action.from_path):
+        return
+    logger.info(f"[{action.action_type}] Moving back to {action.from_path} from {action.to_path}")
+    directory = prepare_target(action.from_path, created_directories if created_directories is not None else set())
+    if journal is not None:
+        journal.begin(action, reverse=True)
+    if same_device(action.to_path, directory):
+        os.rename(action.to_path, action.from_path)
+    else:
+        copy_then_unlink(action.to_path, action.from_path)
+    if journal is not None:
+        journal.commit(action, reverse=True)
+    if action.cache is not None:
+        action.cache.moved(action.to_path, action.from_path)
+    action.status = MoveStatus.UNDONE
+
+
+def bulk_undo(actions, journal=None, workers=8, is_running=lambda: True):
+    # Undoes many moves at once. Actions are grouped by the directory they were moved into, groups run in
+    # parallel and each group is undone newest first. Returns the actions that were undone.
+    groups = defaultdict(list)
+    for action in reversed(actions):
+        groups[os.path.dirname(action.to_path)].append(action)
+    created_directories = set()
+    lock = threading.Lock()
+    undone = []
+
+    def undo_group(group):
+        for action in group:
+            if not is_running():
+                return
+            try:
+                undo_move(action, journal, created_directories)
+            except OSError as e:
+                logger.info(f"Could not move back {action.to_path}: {e}")
+                continue
+            with lock:
+                undone.append(action)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(undo_group, groups.values()))
+    return undone
+
+
+class MoveExecutor:
+    # Applies MoveActions in submission order on a background thread. Moves on the same device are a single
+    # os.rename, moves across devices are copied in parallel and then unlinked. Later moves touching a path
+    # wait for any copy of that path still in flight, so an undo always runs after the move it reverts.
+    def __init__(self, copy_workers=4, journal=None):
+        self.journal = journal
+        self.queue = deque()  # (action, reverse)
+        self.condition = threading.Condition()
+        self.copy_pool = ThreadPoolExecutor(max_workers=copy_workers)
+        self.in_flight = {}  # path -> Future of a cross device copy
+        self.created_directories = set()
+        self.outstanding = 0
+        self.completed = 0
+        self.failures = []
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    def submit(self, action):
+        with self.condition:
+            action.status = MoveStatus.PENDING
+            action.error = None
+            self.queue.append((action, False))
+            self.outstanding += 1
+            METRICS.gauge("move_queue", self.outstanding)
+            self.condition.notify_all()
+
+    def undo(self, action):
+        with self.condition:
+            if (action, False) in self.queue:
+                # Never started, dropping it from the queue is the whole undo
+                self.queue.remove((action, False))
+                action.status = MoveStatus.CANCELLED
+                self.outstanding -= 1
+                self.condition.notify_all()
+                return
+            self.queue.append((action, True))
+            self.outstanding += 1
+            self.condition.notify_all()
+
+    def busy(self, path):
+        with self.condition:
+            if path in self.in_flight:
+                return True
+            return any(path in (action.from_path, action.to_path) for action, _ in self.queue)
+
+    def pending(self):
+        with self.condition:
+            return self.outstanding
+
+    def wait(self):
+        with self.condition:
+            while self.outstanding > 0:
+                self.condition.wait()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while len(self.queue) == 0:
+                    self.condition.wait()
+                action, reverse = self.queue.popleft()
+            try:
+                self.apply(action, reverse)
+            except Exception as e:
+                self.finish(action, reverse, e)
+
+    def apply(self, action, reverse):
+        if reverse:
+            source, target = action.to_path, action.from_path
+        else:
+            source, target = action.from_path, action.to_path
+
+        with self.condition:
+            # Entries are only dropped once the copy has finished and its status is recorded
+            while source in self.in_flight or target in self.in_flight:
+                self.condition.wait()
+
+        if reverse:
+            if action.status != MoveStatus.DONE or os.path.exists(target):
+                # The forward move failed or the file is already back
+                self.finish(action, reverse)
+                return
+            logger.info(f"[{action.action_type}] Moving back to {target} from {source}")
+
+        directory = prepare_target(target, self.created_directories)
+        if self.journal is not None:
+            self.journal.begin(action, reverse)
+        if same_device(source, directory):
+            with stage("move"):
+                os.rename(source, target)
+            self.finish(action, reverse)
+            return
+
+        future = self.copy_pool.submit(copy_then_unlink, source, target)
+        with self.condition:
+            self.in_flight[source] = future
+            self.in_flight[target] = future
+        future.add_done_callback(lambda f: self.copied(action, reverse, source, target, f))
+
+    def copied(self, action, reverse, source, target, future):
+        self.finish(action, reverse, future.exception())
+        with self.condition:
+            for path in (source, target):
+                if self.in_flight.get(path) is future:
+                    del self.in_flight[path]
+            self.condition.notify_all()
+
+    def finish(self, action, reverse, error=None):
+        if error is None:
+            if self.journal is not None and getattr(action, "journal_id", None) is not None:
+                self.journal.commit(action, reverse)
+            if action.cache is not None:
+                if reverse:
+                    action.cache.moved(action.to_path, action.from_path)
+                else:
+                    action.cache.moved(action.from_path, action.to_path)
+            if reverse:
+                action.status = MoveStatus.UNDONE
+            else:
+                action.status = MoveStatus.DONE
+        else:
+            logger.info(f"Could not move {action.from_path}: {error}")
+            if not reverse:
+                action.status = MoveStatus.FAILED
+            action.error = error
+        with self.condition:
+            if error is None:
+                self.completed += 1
+                METRICS.count("moves")
+            else:
+                self.failures.append(action)
+                METRICS.count("move_failures")
+            self.outstanding -= 1
+            METRICS.gauge("move_queue", self.outstanding)
+            self.condition.notify_all()
@@ -0,0 +1,36 @@
+import logging
+
+logger = logging.getLogger("sortr.orientation")
+
+
+def get_orientation(img, cache=None):
+    path = getattr(img, "filename", "")
+    if cache is not None and path:
+        orientation = cache.get_orientation(path)
+        if orientation is not None:
+            return orientation
+    orientation = 1
+    try:
+        exif = img._getexif()
+        if exif is not None:
+            orientation_tag = 274  # EXIF orientation tag
+            orientation = exif.get(orientation_tag, 1)
+    except (AttributeError, KeyError, IndexError) as e:
+        logger.info(f"Could not get orientation: {e}")
+        return None  # EXIF data not available or not usable
+    if cache is not None and path:
+        cache.put_orientation(path, orientation)
+    return orientation
+
+
+def correct_image_orientation(img, cache=None, source=None):
+    # source is the image the EXIF orientation is read from, when img is a thumbnail or copy of it
+    orientation = get_orientation(source if source is not None else img, cache)
+    logger.info(f"Orientation: {orientation}")
+    if orientation == 3:
+        img = img.rotate(180, expand=True)
+    elif orientation == 6:
+        img = img.rotate(270, expand=True)
+    elif orientation == 8:
+        img = img.rotate(90, expand=True)
+    return img
@@ -0,0 +1,89 @@
+import logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, Future
+
+from instrumentation import METRICS, measured
+from sharpness import get_sharpness
+
+logger = logging.getLogger("sortr.parallel")
+
+
+def resolved(value):
+    future = Future()
+    future.set_result(value)
+    return future
+
+
+def score_images(paths, workers=1, is_running=lambda: True, score=get_sharpness, cache=None, key=None):
+    # Yields (path, score) in input order. With more than one worker the scoring runs in a process pool,
+    # only a bounded window of images is submitted ahead so a stop request cancels everything not yet started.
+    # If a cache is given it is consulted and filled on the calling thread, only misses are scored. Files that
+    # cannot be read or decoded (PIL's UnidentifiedImageError is an OSError) are logged and left out.
+    def cached(path):
+        if cache is None:
+            return None
+        return cache.get_score(path, key)
+
+    def store(path, value):
+        if cache is not None:
+            cache.put_score(path, key, value)
+
+    def skip(path, error):
+        logger.info(f"Skipping {path}: {error}")
+        METRICS.count("unreadable")
+
+    if workers <= 1:
+        for path in paths:
+            if not is_running():
+                return
+            try:
+                value = cached(path)
+                if value is None:
+                    value = score(path)
+                    store(path, value)
+            except OSError as e:
+                skip(path, e)
+                continue
+            METRICS.count("images")
+            yield path, value
+        return
+
+    window = workers * 4
+    paths = iter(paths)
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        try:
+            exhausted = False
+            while True:
+                while not exhausted and len(pending) < window:
+                    path = next(paths, None)
+                    if path is None:
+                        exhausted = True
+                        break
+                    try:
+                        value = cached(path)
+                    except OSError as e:
+                        skip(path, e)
+                        continue
+                    if value is not None:
+                        pending.append((path, resolved(value), False))
+                    else:
+                        pending.append((path, executor.submit(measured, score, path), True))
+                METRICS.gauge("scoring_queue", len(pending))
+                if len(pending) == 0 or not is_running():
+                    return
+                path, future, computed = pending.popleft()
+                try:
+                    value = future.result()
+                    if computed:
+                        value, recorded = value
+                        METRICS.merge(recorded)
+                        store(path, value)
+                except OSError as e:
+                    skip(path, e)
+                    continue
+                METRICS.count("images")
+                yield path, value
+        finally:
+            for _, future, _ in pending:
+                future.cancel()
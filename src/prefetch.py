@@ -0,0 +1,94 @@
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from instrumentation import METRICS, stage
+from orientation import correct_image_orientation
+from sharpness import open_file
+from viewport import ImagePyramid
+
+logger = logging.getLogger("sortr.prefetch")
+
+
+class PreparedImage:
+    def __init__(self, path, pyramid, display):
+        self.path = path
+        self.pyramid = pyramid  # Orientation corrected RGB image and its reduced levels
+        self.display = display  # Screen sized copy, ready for ImageTk.PhotoImage
+
+    @property
+    def image(self):
+        return self.pyramid.levels[0]
+
+
+def prepare_image(path, screen_size, cache=None):
+    with stage("prepare"):
+        img = open_file(path)
+        img = correct_image_orientation(img, cache)
+        img = img.convert("RGB")
+
+        screen_width, screen_height = screen_size
+        display = img.copy()
+        img_width, img_height = display.size
+        if img_width > img_height:
+            display.thumbnail((screen_width, screen_height), Image.Resampling.LANCZOS)
+        else:
+            display.thumbnail((min(screen_width, img_width), min(screen_height, img_height)),
+                              Image.Resampling.LANCZOS)
+        return PreparedImage(path, ImagePyramid(img, screen_size), display)
+
+
+class Prefetcher:
+    # Decodes upcoming images on background threads (Pillow releases the GIL while decoding and resizing)
+    # and keeps the results in a bounded LRU so the review loop can show the next image without waiting.
+    def __init__(self, prepare, workers=2, capacity=5):
+        self.prepare = prepare
+        self.capacity = capacity
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.entries = OrderedDict()  # path -> Future[PreparedImage]
+        self.lock = threading.Lock()
+
+    def submit(self, path):
+        with self.lock:
+            if path in self.entries:
+                self.entries.move_to_end(path)
+                return self.entries[path]
+            future = self.executor.submit(self.prepare, path)
+            self.entries[path] = future
+            self.evict()
+            METRICS.gauge("prefetch_entries", len(self.entries))
+            return future
+
+    def evict(self):
+        while len(self.entries) > self.capacity:
+            _, future = self.entries.popitem(last=False)
+            future.cancel()
+
+    def schedule(self, paths):
+        for path in paths:
+            self.submit(path)
+
+    def get(self, path) -> PreparedImage:
+        future = self.submit(path)
+        try:
+            return future.result()
+        except Exception:
+            # Do not keep failures around, the next request for this path tries again
+            self.discard(path)
+            raise
+
+    def discard(self, path):
+        with self.lock:
+            future = self.entries.pop(path, None)
+        if future is not None:
+            future.cancel()
+
+    def shutdown(self):
+        with self.lock:
+            for future in self.entries.values():
+                future.cancel()
+            self.entries.clear()
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,249 @@
+import math
+import operator
+import re
+import time
+
+import numpy as np
+
+from instrumentation import stage
+from orientation import get_orientation
+from sharpness import (open_file, reduce_for_scoring, edge_image, image_variance, gradient_magnitude, convolve3x3,
+                       tile_shape, tile_variances, downscale_factor)
+
+# Immerkær's mask: the difference of two Laplacians, it cancels image structure and leaves the noise
+NOISE_KERNEL = np.array([[1, -2, 1],
+                         [-2, 4, -2],
+                         [1, -2, 1]], dtype=np.int32)
+CLIPPED_LOW = 2  # Levels at or below count as crushed shadows
+CLIPPED_HIGH = 253  # Levels at or above count as blown highlights
+TILE_OPTIONS = {"tile_grid": 8, "tile_percentile": 90, "tile_map": False}
+
+OPERATORS = {"<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge}
+CONDITION_PATTERN = re.compile(r"^\s*([a-z_]+)\s*(<=|>=|<|>)\s*([-+]?[0-9.]+(?:e[-+]?[0-9]+)?)\s*$", re.IGNORECASE)
+
+
+class GrayscaleBuffer:
+    # One decoded grayscale image shared by every metric of a pass. Derived data is computed on first use,
+    # so metrics needing the same histogram or gradients only pay for it once.
+    def __init__(self, image, options=None):
+        self.image = image
+        self.options = dict(TILE_OPTIONS, **(options or {}))
+        self.derived = {}
+
+    def get(self, name, compute):
+        if name not in self.derived:
+            self.derived[name] = compute()
+        return self.derived[name]
+
+    def pixels(self):
+        return self.get("pixels", lambda: np.asarray(self.image, dtype=np.uint8))
+
+    def histogram(self):
+        return self.get("histogram", lambda: np.asarray(self.image.histogram(), dtype=np.float64))
+
+    def gradient(self):
+        return self.get("gradient", lambda: gradient_magnitude(self.image))
+
+    def edges(self):
+        return self.get("edges", lambda: edge_image(self.image))
+
+    def tiles(self):
+        # Edge variance of every tile, from the same edge image as the global sharpness
+        shape = tile_shape(self.image.size, self.options["tile_grid"])
+        return self.get("tiles", lambda: tile_variances(np.asarray(self.edges(), dtype=np.uint8), *shape))
+
+
+class QualityMetric:
+    def __init__(self, name, column, compute, cost, scaled):
+        self.name = name
+        self.column = column  # Field name in statistics records
+        self.compute = compute  # GrayscaleBuffer -> float
+        self.cost = cost  # Metrics run cheapest first so rules can skip the expensive ones
+        self.scaled = scaled  # Depends on the scoring resolution, so reduced scores are calibrated
+
+
+QUALITY_METRICS = {}
+
+
+def register_metric(name, compute, cost, column=None, scaled=False):
+    QUALITY_METRICS[name] = QualityMetric(name, column if column else name.capitalize(), compute, cost, scaled)
+
+
+def exposure(buffer) -> float:
+    # Mean level, 0 to 255
+    histogram = buffer.histogram()
+    return float(np.dot(histogram, np.arange(256)) / histogram.sum())
+
+
+def clipping(buffer) -> float:
+    # Fraction of pixels in crushed shadows or blown highlights
+    histogram = buffer.histogram()
+    return float((histogram[:CLIPPED_LOW + 1].sum() + histogram[CLIPPED_HIGH:].sum()) / histogram.sum())
+
+
+def contrast(buffer) -> float:
+    # RMS contrast, the standard deviation of the levels
+    histogram = buffer.histogram()
+    levels = np.arange(256)
+    total = histogram.sum()
+    mean = np.dot(histogram, levels) / total
+    return float(math.sqrt(np.dot(histogram, (levels - mean) ** 2) / total))
+
+
+def noise(buffer) -> float:
+    # Immerkær's fast estimate of the noise standard deviation
+    pixels = buffer.pixels()
+    height, width = pixels.shape
+    if height < 3 or width < 3:
+        return 0.0
+    response = np.abs(convolve3x3(pixels, NOISE_KERNEL)[1:-1, 1:-1]).sum(dtype=np.float64)
+    return float(response * math.sqrt(math.pi / 2) / (6 * (width - 2) * (height - 2)))
+
+
+def sharpness(buffer) -> float:
+    edges = buffer.edges()
+    with stage("variance"):
+        return image_variance(edges)
+
+
+def tile_max(buffer) -> float:
+    # Sharpness of the sharpest tile, a small sharp subject on a soft background still scores high
+    return float(buffer.tiles().max())
+
+
+def tile_percentile(buffer) -> float:
+    # Less sensitive than the maximum to a single tile of sharp noise or text
+    return float(np.percentile(buffer.tiles(), buffer.options["tile_percentile"]))
+
+
+def gradient(buffer) -> float:
+    return float(buffer.gradient().var(dtype=np.float64))
+
+
+def tenengrad(buffer) -> float:
+    # Mean squared Sobel gradient magnitude
+    return float(np.square(buffer.gradient(), dtype=np.float64).mean())
+
+
+# The histogram metrics hardly change when an image is reduced, the ones built on pixel differences shrink
+# with the scale and are calibrated against full resolution like the sharpness
+register_metric("exposure", exposure, 1)
+register_metric("clipping", clipping, 1)
+register_metric("contrast", contrast, 1)
+register_metric("sharpness", sharpness, 2, scaled=True)
+register_metric("tile_max", tile_max, 2, "TileMax", scaled=True)
+register_metric("tile_percentile", tile_percentile, 2, "TilePercentile", scaled=True)
+register_metric("noise", noise, 3, scaled=True)
+register_metric("gradient", gradient, 4, scaled=True)
+register_metric("tenengrad", tenengrad, 4, scaled=True)
+
+
+def parse_metric_names(text):
+    names = [name.strip().lower() for name in text.split(",") if name.strip()]
+    for name in names:
+        if name not in QUALITY_METRICS:
+            raise ValueError(f"Unknown quality metric {name}, available: {', '.join(QUALITY_METRICS)}")
+    return names
+
+
+def scaled_metrics(metrics):
+    return [name for name in metrics if QUALITY_METRICS[name].scaled]
+
+
+def parse_rules(text):
+    # "sharpness < 500 or clipping > 0.3 and exposure > 200" matches an image if any of the groups separated
+    # by "or" (or ";") matches, a group matches if all of its "and" conditions hold.
+    rules = []
+    for group_text in re.split(r"\bor\b|;", text, flags=re.IGNORECASE):
+        if not group_text.strip():
+            continue
+        group = []
+        for condition_text in re.split(r"\band\b", group_text, flags=re.IGNORECASE):
+            match = CONDITION_PATTERN.match(condition_text)
+            if match is None:
+                raise ValueError(f"Cannot read filter rule '{condition_text.strip()}', expected e.g. 'sharpness < 500'")
+            name, comparison, value = match.groups()
+            parse_metric_names(name)
+            group.append((name.lower(), comparison, float(value)))
+        rules.append(group)
+    return rules
+
+
+def format_rule(group):
+    return " and ".join(f"{name} {comparison} {value:g}" for name, comparison, value in group)
+
+
+def rule_metrics(rules):
+    names = []
+    for group in rules:
+        for name, _, _ in group:
+            if name not in names:
+                names.append(name)
+    return names
+
+
+def matched_rule(values, rules):
+    # The first group whose conditions all hold, None if none does. Metrics without a value do not match.
+    for group in rules:
+        if all(values.get(name) is not None and OPERATORS[comparison](values[name], value)
+               for name, comparison, value in group):
+            return group
+    return None
+
+
+def rescale_rules(rules, calibration, factor):
+    # Thresholds are given on the full resolution scale, an image reduced by factor compares against the
+    # matching reduced scores instead. Groups on a metric without a fit for factor yet are left out.
+    return [[(name, comparison, calibration.to_reduced_scale(name, factor, value))
+             for name, comparison, value in group] for group in rules
+            if all(calibration.fitted(name, factor) for name, _, _ in group)]
+
+
+def uses_tiles(metrics, options=None):
+    return any(name.startswith("tile_") for name in metrics) or bool(options and options.get("tile_map"))
+
+
+def quality_key(resolution, metrics, options=None):
+    # Only what changes the values is part of the key, rules are evaluated on the record after the lookup
+    if list(metrics) == ["sharpness"] and not uses_tiles(metrics, options):
+        return f"image@{resolution}"  # The same record as sharpness.score_image, so the cache entries are shared
+    key = f"quality@{resolution}:{','.join(sorted(metrics))}"
+    if uses_tiles(metrics, options):
+        tiles = dict(TILE_OPTIONS, **(options or {}))
+        key += f"#tiles{tiles['tile_grid']}p{tiles['tile_percentile']}" + ("+map" if tiles["tile_map"] else "")
+    return key
+
+
+def missing_metrics(record, metrics):
+    return [name for name in metrics if record.get(QUALITY_METRICS[name].column) is None]
+
+
+def measure_image(path, resolution=0, metrics=("sharpness",), rules=None, options=None, calibration=None) -> dict:
+    # Decodes once and computes the requested metrics on the shared buffer, cheapest first. With rules, the
+    # remaining metrics are skipped (None) as soon as one rule group already matches, thresholds are moved to
+    # the reduced scale by calibration. options are the tile settings, with tile_map the record also gets the
+    # per-tile variance map as a list of rows.
+    start = time.perf_counter()
+    image = open_file(path)
+    width, height = image.size
+    orientation = get_orientation(image)
+    buffer = GrayscaleBuffer(reduce_for_scoring(image, resolution), options)
+    buffer.image.load()
+    decode_time = time.perf_counter() - start
+    if rules and calibration is not None:
+        rules = rescale_rules(rules, calibration, downscale_factor((width, height), resolution))
+
+    selected = [QUALITY_METRICS[name] for name in metrics]
+    record = {metric.column: None for metric in selected}
+    record.update({"Width": width, "Height": height, "Orientation": orientation, "DecodeTime": decode_time})
+    values = {}
+    for metric in sorted(selected, key=lambda m: m.cost):
+        if rules and matched_rule(values, rules) is not None:
+            break
+        with stage(f"metric_{metric.name}"):
+            values[metric.name] = metric.compute(buffer)
+        record[metric.column] = values[metric.name]
+    if buffer.options["tile_map"]:
+        with stage("metric_tile_map"):
+            record["TileMap"] = np.round(buffer.tiles(), 2).tolist()
+    return record
@@ -0,0 +1,154 @@
+import heapq
+import math
+import os
+import random
+from collections import deque
+
+
+class KLLSketch:
+    # Streaming quantile sketch (Karnin, Lang, Liberty). Level h holds items standing for 2^h inputs each.
+    # When a level is full it is sorted and every other item, from a random offset, moves up a level, so the
+    # memory stays O(k log(n / k)) and the rank error about 1.7 / k. Sketches of disjoint streams merge into
+    # the sketch of the combined stream.
+    def __init__(self, k=200, seed=0):
+        self.k = k
+        self.rng = random.Random(seed)
+        self.compactors = []
+        self.count = 0
+        self.size = 0
+        self.max_size = 0
+        self.grow()
+
+    def grow(self):
+        self.compactors.append([])
+        self.max_size = sum(self.capacity(h) for h in range(len(self.compactors)))
+
+    def capacity(self, h):
+        # Lower levels get geometrically less room than the top one
+        depth = len(self.compactors) - h - 1
+        return int(math.ceil(self.k * (2 / 3) ** depth)) + 1
+
+    def update(self, value):
+        self.compactors[0].append(value)
+        self.count += 1
+        self.size += 1
+        if self.size >= self.max_size:
+            self.compress()
+
+    def compress(self):
+        for h in range(len(self.compactors)):
+            if len(self.compactors[h]) >= self.capacity(h):
+                if h + 1 >= len(self.compactors):
+                    self.grow()
+                items = sorted(self.compactors[h])
+                kept = [items.pop()] if len(items) % 2 else []
+                self.compactors[h + 1].extend(items[self.rng.randrange(2)::2])
+                self.compactors[h] = kept
+                self.size = sum(len(items) for items in self.compactors)
+                if self.size < self.max_size:
+                    break
+
+    def merge(self, other):
+        while len(self.compactors) < len(other.compactors):
+            self.grow()
+        for h, items in enumerate(other.compactors):
+            self.compactors[h].extend(items)
+        self.count += other.count
+        self.size = sum(len(items) for items in self.compactors)
+        while self.size >= self.max_size:
+            self.compress()
+
+    def weighted(self):
+        return sorted((value, 2 ** h) for h, items in enumerate(self.compactors) for value in items)
+
+    def quantile(self, fraction):
+        # Smallest value with at least fraction of the inputs at or below it, None while empty
+        if self.count == 0:
+            return None
+        target = fraction * self.count
+        seen = 0
+        items = self.weighted()
+        for value, weight in items:
+            seen += weight
+            if seen >= target:
+                return value
+        return items[-1][0]
+
+    def to_dict(self):
+        return {"k": self.k, "count": self.count, "compactors": self.compactors}
+
+    @classmethod
+    def from_dict(cls, data, seed=0):
+        sketch = cls(data["k"], seed)
+        for _ in range(len(data["compactors"]) - 1):
+            sketch.grow()
+        sketch.compactors = [list(items) for items in data["compactors"]]
+        sketch.count = data["count"]
+        sketch.size = sum(len(items) for items in sketch.compactors)
+        return sketch
+
+
+class PercentileSelector:
+    # Single pass "drop the blurriest percent": every score goes into the sketch as it arrives, the decision
+    # for an image waits until buffer_size later images were seen and then uses the cut-off estimated so far.
+    # Only the sketch and the buffer are kept, finish() decides what is still buffered with the final estimate.
+    # No more than percent of the images seen so far are dropped. When the drops fall whole images behind
+    # percent of the decided images (scores sorted ascending, every image is the sharpest seen yet when it is
+    # decided), the cut-off is raised by the shortfall relative to the buffer until they catch up.
+    def __init__(self, percent, buffer_size=500, sketch=None, metric="sharpness"):
+        self.fraction = percent / 100
+        self.buffer_size = buffer_size
+        self.sketch = sketch if sketch is not None else KLLSketch()
+        self.metric = metric
+        self.pending = deque()  # (path, score) waiting for a decision
+        self.decided = 0
+        self.dropped = 0
+
+    def add(self, path, score):
+        # Returns (path, reason) for every image decided blurry by this score
+        self.sketch.update(score)
+        self.pending.append((path, score))
+        blurry = []
+        while len(self.pending) > self.buffer_size:
+            path, score = self.pending.popleft()
+            behind = max(0, math.floor(self.fraction * (self.decided + 1)) - self.dropped)
+            blurry.extend(self.decide(path, score, min(1.0, self.fraction + behind / max(self.buffer_size, 1))))
+        return blurry
+
+    def finish(self):
+        # Everything is known now, the remaining budget goes to the lowest buffered scores
+        blurry = []
+        for path, score in sorted(self.pending, key=lambda item: item[1]):
+            blurry.extend(self.decide(path, score, self.fraction))
+        self.pending.clear()
+        return blurry
+
+    def decide(self, path, score, fraction):
+        self.decided += 1
+        threshold = self.sketch.quantile(fraction)
+        if score <= threshold and self.dropped + 1 <= self.fraction * self.sketch.count:
+            self.dropped += 1
+            return [(path, f"{self.metric} <= {threshold:g}, the lowest {self.fraction:.0%}")]
+        return []
+
+
+class TopSelector:
+    # Keeps the n highest scores of every directory. One min-heap of n per directory is enough: an image that
+    # falls out of its heap can never make the top n again, so it is decided at once and nothing is deferred.
+    def __init__(self, n, metric="sharpness"):
+        self.n = n
+        self.metric = metric
+        self.heaps = {}  # directory -> [(score, order, path)]
+        self.order = 0
+
+    def add(self, path, score):
+        heap = self.heaps.setdefault(os.path.dirname(path), [])
+        self.order += 1
+        heapq.heappush(heap, (score, self.order, path))
+        if len(heap) > self.n:
+            _, _, dropped = heapq.heappop(heap)
+            return [(dropped, f"{self.metric} below the top {self.n} of its folder")]
+        return []
+
+    def finish(self):
+        return []
@@ -0,0 +1,298 @@
+import logging
+import threading
+import tkinter as tk
+from functools import partial
+
+from PIL import Image, ImageTk
+
+from actions import MoveActionType, ProcessResult
+from instrumentation import METRICS, start_profile, stop_profile, finish
+from prefetch import Prefetcher, prepare_image
+from scanner import iter_images
+from viewport import ViewportRenderer
+
+logger = logging.getLogger("sortr.review")
+
+CHOICES = {
+    'y': "User confirmed 'yes'",
+    'm': "User selected 'maybe'",
+    'n': "User rejected 'no'",
+}
+
+
+class ReviewSession:
+    # The image list of a review. The tree is enumerated on a background thread, so review starts on the
+    # first images while the rest is still being scanned.
+    def __init__(self, gui, args):
+        self.gui = gui
+        self.root = gui.root
+        self.engine = gui.engine
+        self.args = args
+
+        self.images = []
+        self.groups = {}  # With burst grouping: shown image -> every image the decision applies to
+        self.exhausted = False
+        self.closed = False
+        self.profiler = None
+
+    def start_scan(self):
+        self.scanner = threading.Thread(target=self.scan, daemon=True)
+        self.scanner.start()
+
+    def scan(self):
+        images = iter_images(self.args.input_directory, self.args.output_directory, sort=True)
+        if self.args.burst_grouping:
+            # Only the sharpest image of each burst is shown, so grouping has to see the whole tree first
+            logger.info("Grouping bursts...")
+            for group in self.engine.group_bursts(self.args, images):
+                if self.closed:
+                    return
+                self.groups[group[0]] = group
+                self.images.append(group[0])
+            self.exhausted = True
+            return
+        for path in images:
+            if self.closed:
+                return
+            self.images.append(path)
+        self.exhausted = True
+
+    def group_of(self, path):
+        return self.groups.get(path, [path])
+
+
+class ReviewController(ReviewSession):
+    # Drives the review session from Tk callbacks on one persistent window. The position in the image list
+    # only changes through transition(), which handles OK/NEXT/PREVIOUS/UNDO from ProcessResult.
+    def __init__(self, gui, args, poll_interval=20):
+        super().__init__(gui, args)
+        self.poll_interval = poll_interval
+
+        self.idx = 0
+        self.history = []  # (index, result) for every image that was decided or skipped
+        self.prepared = None
+        self.renderer = None
+        self.drag_x, self.drag_y = 0, 0
+        self.poll_job = None
+
+        # Current, previous (for undo) and the look-ahead images stay decoded
+        screen_size = (self.root.winfo_screenwidth(), self.root.winfo_screenheight())
+        self.prefetcher = Prefetcher(partial(prepare_image, screen_size=screen_size, cache=self.engine.get_cache(args)),
+                                     capacity=args.prefetch_count + 2)
+
+        # Review starts on the first image while the rest of the tree is still being enumerated
+        self.start_scan()
+
+        self.build_window()
+
+    def build_window(self):
+        self.window = tk.Toplevel(self.root)
+        self.window.title("Image Review")
+        self.window.attributes('-fullscreen', True)
+        self.window.protocol("WM_DELETE_WINDOW", self.exit_processing)
+
+        button_frame = tk.Frame(self.window)
+        button_frame.pack(side=tk.TOP, fill=tk.X)
+
+        # Create a Text widget for displaying the file name that is selectable
+        self.file_name_text = tk.Text(button_frame, height=1, width=50, wrap=tk.WORD, font=("Arial", 14))
+        self.file_name_text.config(state=tk.DISABLED)  # Make the text read-only (selectable, but not editable)
+        self.file_name_text.pack(side=tk.TOP, pady=10)
+
+        tk.Button(button_frame, text="Exit", command=self.exit_processing).pack(side=tk.LEFT, padx=10)
+        tk.Button(button_frame, text="Rotate 90° Counter Clockwise",
+                  command=partial(self.rotate, Image.Transpose.ROTATE_270)).pack(side=tk.LEFT, padx=10)
+        tk.Button(button_frame, text="Rotate 90° Clockwise",
+                  command=partial(self.rotate, Image.Transpose.ROTATE_90)).pack(side=tk.LEFT, padx=10)
+        tk.Button(button_frame, text="Previous",
+                  command=partial(self.transition, ProcessResult.PREVIOUS)).pack(side=tk.LEFT, padx=10)
+        tk.Button(button_frame, text="Next",
+                  command=partial(self.transition, ProcessResult.NEXT)).pack(side=tk.LEFT, padx=10)
+        self.undo_button = tk.Button(button_frame, text="Undo", command=partial(self.transition, ProcessResult.UNDO))
+        self.undo_button.pack(side=tk.LEFT, padx=10)
+
+        self.label = tk.Label(self.window)
+        self.label.pack(expand=True, fill=tk.BOTH)
+
+        self.instruction = tk.Label(self.window, text="Press 'y', 'm', or 'n'", bg='white')
+        self.instruction.pack(pady=10)
+
+        self.window.bind('<Key>', self.on_key)
+        self.window.bind('<Left>', lambda event: self.transition(ProcessResult.PREVIOUS))
+        self.window.bind('<Right>', lambda event: self.transition(ProcessResult.NEXT))
+        self.window.bind_all('<MouseWheel>', self.on_mouse_wheel)  # Ensures it works even if the window isn't focused
+        self.window.bind_all('<Button-4>', self.on_mouse_wheel)  # Linux systems sometimes use this event
+        self.window.bind_all('<Button-5>', self.on_mouse_wheel)  #
+        self.label.bind('<ButtonPress-1>', self.on_mouse_press)
+        self.label.bind('<B1-Motion>', self.on_mouse_drag)
+        self.window.focus_force()
+
+    def start(self):
+        logger.info("Step 1: Data loading...")
+        METRICS.reset()
+        self.profiler = start_profile(self.args.profile_path)
+        self.show_current()
+
+    def show_current(self):
+        # Displays images[idx] once it is enumerated and decoded, polling with after() instead of blocking
+        self.poll_job = None
+        if self.closed:
+            return
+        if not self.gui.is_running:
+            logger.info("Pipeline stopped.")
+            self.close()
+            return
+        if self.idx >= len(self.images):
+            if self.exhausted:
+                logger.info("No more images to review.")
+                self.close()
+                return
+            self.set_file_name("Waiting for images...")
+            self.poll_job = self.window.after(self.poll_interval * 5, self.show_current)
+            return
+
+        path = self.images[self.idx]
+        if path not in self.prefetcher.entries and self.engine.mover.busy(path):
+            # An undo of this image is still being applied
+            self.poll_job = self.window.after(self.poll_interval, self.show_current)
+            return
+        future = self.prefetcher.submit(path)
+        self.prefetcher.schedule(self.images[self.idx + 1:self.idx + 1 + self.args.prefetch_count])
+        if not future.done():
+            self.poll_job = self.window.after(self.poll_interval, self.show_current)
+            return
+        if self.prepared is not None and self.prepared.path == path:
+            return
+
+        try:
+            self.prepared = self.prefetcher.get(path)
+        except Exception as e:
+            logger.info(f"Could not open {path}: {e}")
+            self.idx += 1
+            self.show_current()
+            return
+
+        logger.info(f"[{self.idx + 1}] Processing {path}")
+        group = self.group_of(path)
+        if len(group) > 1:
+            self.set_file_name(f"{path.split('/')[-1]} (sharpest of {len(group)})")
+        else:
+            self.set_file_name(path.split("/")[-1])
+        if self.renderer is not None:
+            self.renderer.cancel()
+        img_tk = ImageTk.PhotoImage(self.prepared.display)
+        self.label.config(image=img_tk)
+        self.label.image = img_tk
+        self.renderer = ViewportRenderer(self.label, self.prepared.pyramid, self.prepared.display.size)
+        self.undo_button.config(state=tk.NORMAL if len(self.engine.select_history) > 0 else tk.DISABLED)
+
+    def set_file_name(self, text):
+        self.file_name_text.config(state=tk.NORMAL)
+        self.file_name_text.delete("1.0", tk.END)
+        self.file_name_text.insert(tk.END, text)
+        self.file_name_text.config(state=tk.DISABLED)
+
+    def current_path(self):
+        if self.prepared is None or self.idx >= len(self.images) or self.images[self.idx] != self.prepared.path:
+            return None
+        return self.prepared.path
+
+    def on_key(self, event):
+        if event.char not in CHOICES:
+            return
+        path = self.current_path()
+        if path is None:
+            return
+        group = self.group_of(path)
+        if len(group) > 1:
+            logger.info(f"{CHOICES[event.char]} for {path} and {len(group) - 1} similar images")
+        else:
+            logger.info(f"{CHOICES[event.char]} for {path}")
+        self.engine.handle_group_selection(group, event.char, self.args)
+        METRICS.count("decisions")
+        logger.info(f"Image processing complete for {path}")
+        self.transition(ProcessResult.OK)
+
+    def transition(self, result: ProcessResult):
+        if result in (ProcessResult.OK, ProcessResult.NEXT):
+            if self.current_path() is None:
+                return
+            if result == ProcessResult.NEXT:
+                logger.info("Skipping to next image")
+            self.history.append((self.idx, result))
+            self.idx += 1
+        elif result == ProcessResult.PREVIOUS:
+            if len(self.history) == 0:
+                return
+            logger.info("Going back to previous image")
+            self.step_back()
+        elif result == ProcessResult.UNDO:
+            # Steps back to the last sorted image, re-showing anything skipped after it
+            if not any(r == ProcessResult.OK for _, r in self.history):
+                return
+            logger.info("Undoing last action")
+            while self.step_back() != ProcessResult.OK:
+                pass
+        self.prepared = None
+        self.cancel_poll()
+        self.show_current()
+
+    def step_back(self):
+        idx, result = self.history.pop()
+        if result == ProcessResult.OK:
+            logger.info(f"Undoing image: {self.images[idx]}")
+            for _ in self.group_of(self.images[idx]):
+                self.engine.undo_last(MoveActionType.SELECT)
+        self.idx = idx
+        return result
+
+    def rotate(self, method):
+        if self.renderer is not None:
+            self.renderer.transpose(method)
+
+    def on_mouse_wheel(self, event):
+        if self.renderer is None:
+            return
+        zoom_factor = 1.1
+        anchor_x = event.x_root - self.label.winfo_rootx()
+        anchor_y = event.y_root - self.label.winfo_rooty()
+
+        # For Windows and Linux, event.delta might return different values. Adjust accordingly
+        if event.delta > 0 or event.num == 5:  # Scroll up (zoom in)
+            self.renderer.zoom(1 / zoom_factor, anchor_x, anchor_y)
+        elif event.delta < 0 or event.num == 4:  # Scroll down (zoom out)
+            self.renderer.zoom(zoom_factor, anchor_x, anchor_y)
+
+    def on_mouse_press(self, event):
+        self.drag_x, self.drag_y = event.x, event.y
+
+    def on_mouse_drag(self, event):
+        if self.renderer is None:
+            return
+        self.renderer.pan(event.x - self.drag_x, event.y - self.drag_y)
+        self.drag_x, self.drag_y = event.x, event.y
+
+    def exit_processing(self):
+        logger.info("Exiting image processing")
+        self.close()
+
+    def cancel_poll(self):
+        if self.poll_job is not None:
+            self.window.after_cancel(self.poll_job)
+            self.poll_job = None
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.cancel_poll()
+        if self.renderer is not None:
+            self.renderer.cancel()
+        self.prefetcher.shutdown()
+        self.window.unbind_all('<MouseWheel>')
+        self.window.unbind_all('<Button-4>')
+        self.window.unbind_all('<Button-5>')
+        self.window.destroy()
+        stop_profile(self.profiler, self.args.profile_path)
+        finish("review", self.args.metrics_path)
+        self.gui.review_finished()
@@ -0,0 +1,75 @@
+import logging
+import os
+
+from instrumentation import stage, count
+
+logger = logging.getLogger("sortr.scanner")
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+BLURRY_DIRECTORY = ".too_blurry"
+OUTPUT_DIRECTORIES = ("YES", "NO", "MAYBE", BLURRY_DIRECTORY)
+
+
+def is_image(name):
+    return name.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def is_hidden(name):
+    # Like glob: dotfiles and dot folders, e.g. macOS ._ resource forks and NAS thumbnail folders
+    return name.startswith(".")
+
+
+def pruned_directories(directory, output_directory=None):
+    output_directory = output_directory if output_directory else directory
+    return {os.path.normcase(os.path.abspath(os.path.join(output_directory, d))) for d in OUTPUT_DIRECTORIES}
+
+
+def is_pruned(path, pruned):
+    return os.path.basename(path) == BLURRY_DIRECTORY or os.path.normcase(os.path.abspath(path)) in pruned
+
+
+def walk(directory, output_directory=None, sort=False):
+    # Single os.scandir walk yielding (directory, image entries, subdirectory paths) per directory. Any
+    # .too_blurry directory and the YES/NO/MAYBE/.too_blurry trees inside the output directory are pruned
+    # instead of filtered afterwards. Hidden names are skipped. With sort=True every directory is listed in
+    # name order.
+    pruned = pruned_directories(directory, output_directory)
+    stack = [directory]
+    while stack:
+        current = stack.pop()
+        try:
+            with stage("scan"), os.scandir(current) as it:
+                entries = list(it)
+            count("directories")
+        except OSError as e:
+            logger.info(f"Could not read {current}: {e}")
+            continue
+        if sort:
+            entries.sort(key=lambda entry: entry.name)
+        images = []
+        subdirectories = []
+        for entry in entries:
+            if is_hidden(entry.name):
+                continue
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if not is_pruned(entry.path, pruned):
+                        subdirectories.append(entry.path)
+                elif is_image(entry.name) and entry.is_file():
+                    images.append(entry)
+            except OSError as e:
+                logger.info(f"Could not read {entry.path}: {e}")
+        yield current, images, subdirectories
+        # Reversed so the stack pops them in listing order
+        stack.extend(reversed(subdirectories))
+
+
+def iter_images(directory, output_directory=None, sort=False):
+    # Image paths as they are found, files of a directory before its subdirectories
+    for _, images, _ in walk(directory, output_directory, sort):
+        for entry in images:
+            yield entry.path
+
+
+def get_images(directory, output_directory=None):
+    return sorted(iter_images(directory, output_directory))
@@ -0,0 +1,125 @@
+import glob
+import hashlib
+import heapq
+import json
+import os
+
+from quantiles import KLLSketch
+from sharpness import ScoreCalibration
+from stats_writer import read_records, SETTINGS_SUFFIX
+
+CALIBRATION_FILE = "calibration.json"
+SKETCH_SUFFIX = ".sketch.json"
+CALIBRATION_SUFFIX = ".calibration.json"
+SIDECAR_SUFFIXES = (SKETCH_SUFFIX, CALIBRATION_SUFFIX, SETTINGS_SUFFIX)
+
+
+def relative_key(path, root):
+    # Shard keys use the path below the input root with forward slashes, so nodes that mount the archive
+    # at different locations or run on different platforms agree on the assignment
+    return os.path.relpath(path, root).replace(os.sep, "/")
+
+
+def shard_of(key, shards):
+    digest = hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % shards
+
+
+def manifest_name(index, shards):
+    return f"manifest-{index:04d}-of-{shards:04d}.txt"
+
+
+def write_manifests(images, root, shards, directory):
+    # Splits image paths into shard manifests of relative paths, each sorted. Returns the manifest paths.
+    os.makedirs(directory, exist_ok=True)
+    assigned = [[] for _ in range(shards)]
+    for path in images:
+        key = relative_key(path, root)
+        assigned[shard_of(key, shards)].append(key)
+    paths = []
+    for index, keys in enumerate(assigned):
+        path = os.path.join(directory, manifest_name(index, shards))
+        with open(path, "w", encoding="utf-8") as f:
+            for key in sorted(keys):
+                f.write(key + "\n")
+        paths.append(path)
+    return paths
+
+
+def read_manifest(path, root):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            key = line.rstrip("\n")
+            if key:
+                yield os.path.join(root, *key.split("/"))
+
+
+def save_calibration(path, calibration, resolution):
+    with open(path, "w") as f:
+        json.dump({"resolution": resolution, **calibration.to_dict()}, f)
+
+
+def sketch_path(result_path):
+    return result_path + SKETCH_SUFFIX
+
+
+def calibration_path(result_path):
+    return result_path + CALIBRATION_SUFFIX
+
+
+def save_sketch(result_path, sketch, column):
+    # The quantile sketch of one score column of a result, merged with the others for relative thresholds
+    with open(sketch_path(result_path), "w") as f:
+        json.dump({"column": column, **sketch.to_dict()}, f)
+
+
+def load_sketch(result_path, column):
+    path = sketch_path(result_path)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        data = json.load(f)
+    if data.get("column") != column:
+        return None
+    return KLLSketch.from_dict(data)
+
+
+def load_calibration(path, resolution, metrics):
+    # None unless the file was written for the same scoring resolution and metrics
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        data = json.load(f)
+    if data.get("resolution") != resolution or data.get("metrics") != list(metrics) or "pairs" not in data:
+        return None
+    return ScoreCalibration.from_dict(data)
+
+
+def same_path(a, b):
+    return os.path.normcase(os.path.realpath(a)) == os.path.normcase(os.path.realpath(b))
+
+
+def expand_result_paths(patterns, output_path=None):
+    # A glob leaves out the merged output of an earlier run, a path given as it is stays for the caller to refuse
+    paths = []
+    for pattern in patterns:
+        matches = sorted(match for match in glob.glob(pattern) if not match.endswith(SIDECAR_SUFFIXES))
+        if not matches:
+            paths.append(pattern)
+        elif output_path and glob.has_magic(pattern):
+            paths.extend(match for match in matches if not same_path(match, output_path))
+        else:
+            paths.extend(matches)
+    return paths
+
+
+def merge_results(paths):
+    # Shard results are written in manifest order, so a k-way merge yields one sorted stream without loading
+    # everything. A file present in more than one result (a re-run shard) is only yielded once.
+    streams = [read_records(path) for path in paths]
+    previous = None
+    for record in heapq.merge(*streams, key=lambda r: r["File"]):
+        if record["File"] == previous:
+            continue
+        previous = record["File"]
+        yield record
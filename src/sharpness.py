@@ -0,0 +1,231 @@
+import math
+import os
+import time
+
+import numpy as np
+from PIL import Image, ImageFilter, ImageStat
+
+from instrumentation import stage, count
+from orientation import get_orientation
+
+# 3x3 Sobel kernels, applied as separate X and Y passes
+SOBEL_X = np.array([[-1, 0, 1],
+                    [-2, 0, 2],
+                    [-1, 0, 1]], dtype=np.int32)
+SOBEL_Y = SOBEL_X.T
+
+
+def open_file(f):
+    with stage("open"):
+        img = Image.open(f)
+    if isinstance(f, str):
+        count("bytes_read", os.path.getsize(f))
+    return img
+
+
+def open_for_scoring(f, resolution=0):
+    # resolution is the longest edge in pixels used for scoring, 0 keeps the full resolution
+    return reduce_for_scoring(open_file(f), resolution)
+
+
+def reduce_for_scoring(image, resolution=0):
+    if resolution <= 0 or max(image.size) <= resolution:
+        return to_grayscale(image)
+    scale = resolution / max(image.size)
+    requested = (math.ceil(image.size[0] * scale), math.ceil(image.size[1] * scale))
+    # JPEG only: let the decoder downscale by 1/2, 1/4 or 1/8 and skip the chroma planes
+    image.draft('L', requested)
+    image = to_grayscale(image)
+    with stage("resize"):
+        image.thumbnail((resolution, resolution), Image.Resampling.BILINEAR)
+    return image
+
+
+def to_grayscale(image):
+    with stage("decode"):
+        image.load()
+    if image.mode == 'L':
+        return image
+    with stage("grayscale"):
+        return image.convert('L')
+
+
+def image_variance(image) -> float:
+    # ImageStat works from the histogram in C, so no per-pixel Python objects are created
+    stat = ImageStat.Stat(image)
+    return stat.var[0]
+
+
+def tile_shape(size, grid=8):
+    # grid tiles along the longer edge, as many of about the same size along the shorter one
+    width, height = size
+    longest = max(width, height)
+    return max(1, round(grid * height / longest)), max(1, round(grid * width / longest))
+
+
+def tile_variances(pixels, rows, cols):
+    # Variance of every tile of a 2D array in O(pixels) from summed-area tables of the values and their
+    # squares. The tables are only needed on the tile grid, so the rows between two grid lines are summed
+    # band by band first and only rows x width prefix sums are ever held in memory.
+    height, width = pixels.shape
+    ys = np.linspace(0, height, rows + 1).astype(np.int64)
+    xs = np.linspace(0, width, cols + 1).astype(np.int64)
+    sums = np.zeros((rows, width + 1), dtype=np.int64)
+    squares = np.zeros((rows, width + 1), dtype=np.int64)
+    for row in range(rows):
+        band = pixels[ys[row]:ys[row + 1]]
+        np.cumsum(band.sum(axis=0, dtype=np.int64), out=sums[row, 1:])
+        # 255 squared still fits 16 bits, half the memory of squaring in 64 bits
+        wide = band.astype(np.uint16 if band.dtype == np.uint8 else np.int64)
+        np.cumsum(np.square(wide).sum(axis=0, dtype=np.int64), out=squares[row, 1:])
+    counts = np.outer(np.diff(ys), np.diff(xs)).astype(np.float64)
+    counts[counts == 0] = 1
+    tile_sums = (sums[:, xs[1:]] - sums[:, xs[:-1]]) / counts
+    tile_squares = (squares[:, xs[1:]] - squares[:, xs[:-1]]) / counts
+    return np.maximum(tile_squares - tile_sums * tile_sums, 0.0)
+
+
+def edge_image(grayscale_image):
+    with stage("edges"):
+        return grayscale_image.filter(ImageFilter.FIND_EDGES)
+
+
+def laplacian_variance(grayscale_image) -> float:
+    laplacian_image = edge_image(grayscale_image)
+    with stage("variance"):
+        return image_variance(laplacian_image)
+
+
+def convolve3x3(pixels, kernel):
+    # Border pixels are replicated so the output keeps the input size
+    padded = np.pad(pixels, 1, mode='edge').astype(np.int32)
+    height, width = pixels.shape
+    result = np.zeros((height, width), dtype=np.int32)
+    for dy in range(3):
+        for dx in range(3):
+            weight = kernel[dy, dx]
+            if weight == 0:
+                continue
+            result += weight * padded[dy:dy + height, dx:dx + width]
+    return result
+
+
+def gradient_magnitude(grayscale_image):
+    pixels = np.asarray(grayscale_image, dtype=np.uint8)
+    gx = convolve3x3(pixels, SOBEL_X)
+    gy = convolve3x3(pixels, SOBEL_Y)
+    return np.sqrt((gx * gx + gy * gy).astype(np.float32))
+
+
+def gradient_variance(grayscale_image) -> float:
+    with stage("edges"):
+        magnitude = gradient_magnitude(grayscale_image)
+    with stage("variance"):
+        return float(magnitude.var(dtype=np.float64))
+
+
+def get_sharpness(path, resolution=0) -> float:
+    # Variance of the edge-filtered grayscale image
+    return laplacian_variance(open_for_scoring(path, resolution))
+
+
+def calculate_gradient_sharpness(path: str, resolution=0) -> float:
+    # Variance of the Sobel gradient magnitude
+    return gradient_variance(open_for_scoring(path, resolution))
+
+
+def score_image(path, resolution=0) -> dict:
+    # Sharpness plus the facts that come for free from the same decode
+    start = time.perf_counter()
+    image = open_file(path)
+    width, height = image.size
+    orientation = get_orientation(image)
+    grayscale_image = reduce_for_scoring(image, resolution)
+    grayscale_image.load()
+    decode_time = time.perf_counter() - start
+    return {
+        "Sharpness": laplacian_variance(grayscale_image),
+        "Width": width,
+        "Height": height,
+        "Orientation": orientation,
+        "DecodeTime": decode_time,
+    }
+
+
+def calculate_variance(pixels) -> float:
+    values = np.asarray(pixels, dtype=np.float64)
+    if values.size == 0:
+        raise ZeroDivisionError("Cannot calculate the variance of an empty pixel sequence")
+    return float(values.var())
+
+
+def downscale_factor(size, resolution=0) -> int:
+    # 1 for an image scored at full resolution, otherwise the power of two nearest to how much it was reduced
+    longest = max(size)
+    if resolution <= 0 or longest <= resolution:
+        return 1
+    return 2 ** max(1, round(math.log2(longest / resolution)))
+
+
+def fit_power_law(reduced_scores, full_scores):
+    # (slope, intercept) of a straight line through the scores in log space
+    reduced = np.log1p(np.asarray(reduced_scores, dtype=np.float64))
+    full = np.log1p(np.asarray(full_scores, dtype=np.float64))
+    if len(reduced) == 0:
+        return 1.0, 0.0
+    if len(reduced) < 2 or np.ptp(reduced) == 0:
+        # Not enough spread for a slope, only correct the offset
+        return 1.0, float(np.mean(full - reduced))
+    slope, intercept = np.polyfit(reduced, full, 1)
+    if slope <= 0:
+        return 1.0, float(np.mean(full - reduced))
+    return float(slope), float(intercept)
+
+
+class ScoreCalibration:
+    # Maps scores taken at a reduced scoring resolution onto the full resolution scale. Every metric and
+    # downscale factor gets its own power law fit, from the first images of that factor scored both ways, so
+    # a tree mixing camera and phone resolutions is not fitted with one curve. Images that were not reduced
+    # keep their score.
+    def __init__(self, metrics=("sharpness",), samples=16):
+        self.metrics = list(metrics)  # The metrics that depend on the scoring resolution
+        self.samples = samples
+        self.pairs = {}  # (metric, factor) -> ([reduced], [full]) of the images sampled so far
+        self.fits = {}  # (metric, factor) -> (slope, intercept)
+
+    def needs_sample(self, metric, factor) -> bool:
+        return factor > 1 and len(self.pairs.get((metric, factor), ((), ()))[0]) < self.samples
+
+    def add_sample(self, metric, factor, reduced_score, full_score):
+        reduced_scores, full_scores = self.pairs.setdefault((metric, factor), ([], []))
+        reduced_scores.append(reduced_score)
+        full_scores.append(full_score)
+        self.fits[(metric, factor)] = fit_power_law(reduced_scores, full_scores)
+
+    def fitted(self, metric, factor) -> bool:
+        return factor == 1 or metric not in self.metrics or (metric, factor) in self.fits
+
+    def to_full_scale(self, metric, factor, score: float) -> float:
+        if factor == 1 or metric not in self.metrics:
+            return score
+        slope, intercept = self.fits[(metric, factor)]
+        return math.expm1(slope * math.log1p(score) + intercept)
+
+    def to_reduced_scale(self, metric, factor, score: float) -> float:
+        if factor == 1 or metric not in self.metrics:
+            return score
+        slope, intercept = self.fits[(metric, factor)]
+        return math.expm1((math.log1p(score) - intercept) / slope)
+
+    def to_dict(self):
+        return {"metrics": self.metrics, "samples": self.samples,
+                "pairs": [[metric, factor, reduced_scores, full_scores]
+                          for (metric, factor), (reduced_scores, full_scores) in self.pairs.items()]}
+
+    @classmethod
+    def from_dict(cls, data):
+        calibration = cls(data["metrics"], data["samples"])
+        for metric, factor, reduced_scores, full_scores in data["pairs"]:
+            for reduced_score, full_score in zip(reduced_scores, full_scores):
+                calibration.add_sample(metric, factor, reduced_score, full_score)
+        return calibration
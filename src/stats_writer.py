@@ -0,0 +1,144 @@
+import csv
+import hashlib
+import json
+import os
+
+STATS_FIELDS = ["File", "Sharpness", "Width", "Height", "Orientation", "DecodeTime"]
+NUMERIC_FIELDS = {"Sharpness": float, "Width": int, "Height": int, "Orientation": int, "DecodeTime": float,
+                  "Exposure": float, "Clipping": float, "Contrast": float, "Noise": float, "Gradient": float,
+                  "Tenengrad": float, "TileMax": float, "TilePercentile": float}
+SETTINGS_SUFFIX = ".settings.json"
+
+
+def settings_path(path):
+    return path + SETTINGS_SUFFIX
+
+
+def format_for(path):
+    return "csv" if path.lower().endswith(".csv") else "jsonl"
+
+
+def read_records(path):
+    # Yields the records of a statistics file in file order, CSV values are converted back to numbers
+    with open(path, newline="", encoding="utf-8") as f:
+        if format_for(path) == "csv":
+            for row in csv.DictReader(f):
+                for field, convert in NUMERIC_FIELDS.items():
+                    if row.get(field) not in (None, ""):
+                        row[field] = convert(row[field])
+                yield row
+        else:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+
+def read_header(path):
+    with open(path, newline="", encoding="utf-8") as f:
+        return next(csv.reader(f), [])
+
+
+def matches(path, fields, settings):
+    # True if path can be resumed: it does not exist yet, or it was started with the same fields and settings
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return True
+    try:
+        with open(settings_path(path)) as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        return False
+    if saved != {"fields": list(fields), "settings": settings}:
+        return False
+    return format_for(path) != "csv" or read_header(path) == list(fields)
+
+
+def resumable_path(path, fields, settings):
+    # path if it can be resumed, otherwise a name of its own for these fields and settings next to it, so
+    # runs with different scoring settings never append to one file
+    if matches(path, fields, settings):
+        return path
+    text = json.dumps({"fields": list(fields), "settings": settings}, sort_keys=True)
+    root, extension = os.path.splitext(path)
+    return f"{root}_{hashlib.blake2b(text.encode(), digest_size=4).hexdigest()}{extension}"
+
+
+def trim_partial_line(path):
+    # A run that was killed mid-write can leave half a record at the end of the file
+    with open(path, "rb+") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size == 0:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            return
+        position = size - 1
+        while position > 0:
+            f.seek(position - 1)
+            if f.read(1) == b"\n":
+                break
+            position -= 1
+        f.truncate(position)
+
+
+class StatsWriter:
+    # Writes one statistics record per image as soon as it is scored, as JSON Lines or CSV. Opening an
+    # existing file resumes it: the files already in it are available in recorded and new records are appended.
+    # With settings, a new file gets them in a sidecar and an existing one is only resumed if they match.
+    def __init__(self, path, output_format="jsonl", fields=None, sync_every=1000, settings=None):
+        self.path = path
+        self.output_format = output_format
+        self.fields = fields if fields else STATS_FIELDS
+        self.sync_every = sync_every
+        self.count = 0
+        self.recorded = set()
+
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        if settings is not None and not matches(path, self.fields, settings):
+            raise ValueError(f"{path} was written with different fields or scoring settings")
+        if settings is not None and not exists:
+            with open(settings_path(path), "w") as f:
+                json.dump({"fields": list(self.fields), "settings": settings}, f)
+        if exists:
+            trim_partial_line(path)
+            self.recorded = self.read_recorded()
+        self.file = open(path, "a", newline="", encoding="utf-8")
+        self.csv_writer = None
+        if output_format == "csv":
+            self.csv_writer = csv.DictWriter(self.file, fieldnames=self.fields, extrasaction="ignore")
+            if not exists:
+                self.csv_writer.writeheader()
+        elif output_format != "jsonl":
+            raise ValueError(f"Unknown statistics format {output_format}, expected 'jsonl' or 'csv'")
+
+    def read_recorded(self):
+        recorded = set()
+        with open(self.path, newline="", encoding="utf-8") as f:
+            if self.output_format == "csv":
+                for row in csv.DictReader(f):
+                    recorded.add(row["File"])
+            else:
+                for line in f:
+                    try:
+                        recorded.add(json.loads(line)["File"])
+                    except (ValueError, KeyError):
+                        continue
+        return recorded
+
+    def write(self, record):
+        if self.csv_writer is not None:
+            self.csv_writer.writerow(record)
+        else:
+            self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+        self.recorded.add(record["File"])
+        self.count += 1
+        if self.count % self.sync_every == 0:
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
@@ -0,0 +1,147 @@
+import hashlib
+import io
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import Image, ExifTags
+
+from cache import default_cache_path
+from instrumentation import stage, count
+from orientation import correct_image_orientation
+from sharpness import open_file
+
+logger = logging.getLogger("sortr.thumbnails")
+
+THUMBNAIL_EXTENSION = ".jpg"
+THUMBNAIL_QUALITY = 85
+JPEG_INTERCHANGE_FORMAT = 0x0201  # IFD1 tags locating the embedded JPEG thumbnail
+JPEG_INTERCHANGE_FORMAT_LENGTH = 0x0202
+
+
+def default_thumbnail_directory():
+    return os.path.join(os.path.dirname(default_cache_path()), "thumbnails")
+
+
+def embedded_thumbnail(img):
+    # The JPEG thumbnail in the EXIF IFD1, None if there is none. Offsets are relative to the TIFF header.
+    raw = img.info.get("exif")
+    if not raw:
+        return None
+    try:
+        ifd1 = img.getexif().get_ifd(ExifTags.IFD.IFD1)
+        offset = ifd1.get(JPEG_INTERCHANGE_FORMAT)
+        length = ifd1.get(JPEG_INTERCHANGE_FORMAT_LENGTH)
+        if not offset or not length:
+            return None
+        if raw.startswith(b"Exif\x00\x00"):
+            raw = raw[6:]
+        thumbnail = Image.open(io.BytesIO(raw[offset:offset + length]))
+        thumbnail.load()
+        return thumbnail
+    except (OSError, ValueError, SyntaxError, KeyError) as e:
+        logger.info(f"Could not read the embedded thumbnail of {getattr(img, 'filename', '')}: {e}")
+        return None
+
+
+def make_thumbnail(path, size, cache=None):
+    # Orientation corrected RGB thumbnail whose longest edge is at most size. Uses the embedded EXIF thumbnail
+    # when it has at least size pixels on its longest edge, otherwise lets the JPEG decoder downscale, so
+    # neither decodes at full size and every cell gets the same thumbnail size.
+    with stage("thumbnail"):
+        img = open_file(path)
+        thumbnail = embedded_thumbnail(img)
+        if thumbnail is not None and max(thumbnail.size) >= size:
+            count("exif_thumbnails")
+        else:
+            img.draft("RGB", (size, size))
+            thumbnail = img
+        thumbnail = thumbnail.convert("RGB")
+        thumbnail.thumbnail((size, size), Image.Resampling.LANCZOS)
+        return correct_image_orientation(thumbnail, cache, source=img)
+
+
+class ThumbnailCache:
+    # Thumbnails on disk as JPEG files named after a hash of the image path, size, mtime and thumbnail size,
+    # so an edited image gets a new entry and the stale one ages out. Bounded by the total size of the files,
+    # the least recently used go first. Safe to use from worker threads.
+    def __init__(self, directory=None, max_bytes=512 * 1024 * 1024, size=192):
+        self.directory = directory if directory else default_thumbnail_directory()
+        self.max_bytes = max_bytes
+        self.size = size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # file name -> bytes, least recently used first
+        self.total_bytes = 0
+
+        os.makedirs(self.directory, exist_ok=True)
+        found = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(THUMBNAIL_EXTENSION) and entry.is_file():
+                    stat = entry.stat()
+                    found.append((stat.st_mtime_ns, entry.name, stat.st_size))
+        # The mtime of a thumbnail is bumped on every use, so it orders the entries across sessions
+        for _, name, file_size in sorted(found):
+            self.entries[name] = file_size
+            self.total_bytes += file_size
+
+    def file_name(self, path):
+        stat = os.stat(path)
+        key = f"{os.path.abspath(path)}\0{stat.st_size}\0{stat.st_mtime_ns}\0{self.size}"
+        return hashlib.blake2b(key.encode("utf-8", "surrogateescape"), digest_size=16).hexdigest() + THUMBNAIL_EXTENSION
+
+    def get(self, path):
+        name = self.file_name(path)
+        file_path = os.path.join(self.directory, name)
+        with self.lock:
+            if name not in self.entries:
+                count("thumbnail_misses")
+                return None
+            self.entries.move_to_end(name)
+        try:
+            with Image.open(file_path) as thumbnail:
+                thumbnail.load()
+            os.utime(file_path)
+        except OSError:
+            self.forget(name)
+            count("thumbnail_misses")
+            return None
+        count("thumbnail_hits")
+        return thumbnail
+
+    def put(self, path, thumbnail):
+        name = self.file_name(path)
+        file_path = os.path.join(self.directory, name)
+        temporary = f"{file_path}.{threading.get_ident()}.tmp"
+        thumbnail.save(temporary, "JPEG", quality=THUMBNAIL_QUALITY)
+        os.replace(temporary, file_path)
+        file_size = os.path.getsize(file_path)
+        with self.lock:
+            self.total_bytes += file_size - self.entries.pop(name, 0)
+            self.entries[name] = file_size
+            self.evict()
+
+    def evict(self):
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            name, file_size = self.entries.popitem(last=False)
+            self.total_bytes -= file_size
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    def forget(self, name):
+        with self.lock:
+            self.total_bytes -= self.entries.pop(name, 0)
+
+    def thumbnail(self, path, cache=None):
+        # The cached thumbnail, generated and stored on a miss. cache is the score cache for orientations.
+        thumbnail = self.get(path)
+        if thumbnail is None:
+            thumbnail = make_thumbnail(path, self.size, cache)
+            try:
+                self.put(path, thumbnail)
+            except OSError as e:
+                logger.info(f"Could not store the thumbnail of {path}: {e}")
+        return thumbnail
@@ -0,0 +1,126 @@
+from PIL import Image, ImageTk
+
+# Filters used while the user is zooming or dragging and once input has gone idle
+INTERACTIVE_FILTER = Image.Resampling.BILINEAR
+REFINED_FILTER = Image.Resampling.LANCZOS
+
+
+class ImagePyramid:
+    # Mipmap levels of one image, each half the size of the previous, down to the display size
+    def __init__(self, image, min_size):
+        self.levels = [image]
+        min_edge = max(1, max(min_size))
+        while max(self.levels[-1].size) >= 2 * min_edge:
+            self.levels.append(self.levels[-1].reduce(2))
+
+    @property
+    def size(self):
+        return self.levels[0].size
+
+    def level_for(self, scale):
+        # Smallest level that still has at least as many pixels as the requested scale needs
+        chosen = 0
+        for idx, level in enumerate(self.levels):
+            if level.size[0] / self.size[0] >= scale:
+                chosen = idx
+        return chosen
+
+    def transpose(self, method):
+        self.levels = [level.transpose(method) for level in self.levels]
+
+    def render(self, scale, left, top, width, height, resample):
+        # Crops the visible region first and resamples only that region. left/top are in full resolution
+        # pixels, width/height are the viewport size in screen pixels.
+        full_width, full_height = self.size
+        right = min(full_width, left + width / scale)
+        bottom = min(full_height, top + height / scale)
+        output_size = (max(1, round((right - left) * scale)), max(1, round((bottom - top) * scale)))
+
+        level = self.levels[self.level_for(scale)]
+        level_scale = level.size[0] / full_width
+        box = (left * level_scale, top * level_scale, right * level_scale, bottom * level_scale)
+        return level.resize(output_size, resample, box=box)
+
+
+class ViewportRenderer:
+    # Zoom and pan state for one Tk label. Bursts of wheel and drag events are coalesced into a single fast
+    # render per frame, followed by a LANCZOS refinement once input has been idle for refine_delay ms.
+    def __init__(self, label, pyramid, fit_size, frame_delay=15, refine_delay=200):
+        self.label = label
+        self.pyramid = pyramid
+        self.fit_size = fit_size
+        self.frame_delay = frame_delay
+        self.refine_delay = refine_delay
+        self.zoom_level = 1.0  # Relative to the image fitted to the screen
+        self.left = 0.0
+        self.top = 0.0
+        self.frame_job = None
+        self.refine_job = None
+
+    def fit_scale(self):
+        return min(self.fit_size[0] / self.pyramid.size[0], self.fit_size[1] / self.pyramid.size[1])
+
+    def scale(self):
+        return self.fit_scale() * self.zoom_level
+
+    def view_size(self):
+        width, height = self.label.winfo_width(), self.label.winfo_height()
+        if width <= 1 or height <= 1:
+            return self.fit_size
+        return width, height
+
+    def clamp(self):
+        width, height = self.view_size()
+        scale = self.scale()
+        self.left = min(max(0.0, self.left), max(0.0, self.pyramid.size[0] - width / scale))
+        self.top = min(max(0.0, self.top), max(0.0, self.pyramid.size[1] - height / scale))
+
+    def zoom(self, factor, anchor_x=0, anchor_y=0):
+        # Keeps the image point under the anchor (in screen pixels) in place
+        old_scale = self.scale()
+        self.zoom_level *= factor
+        new_scale = self.scale()
+        self.left += anchor_x / old_scale - anchor_x / new_scale
+        self.top += anchor_y / old_scale - anchor_y / new_scale
+        self.request()
+
+    def pan(self, dx, dy):
+        scale = self.scale()
+        self.left -= dx / scale
+        self.top -= dy / scale
+        self.request()
+
+    def transpose(self, method):
+        self.pyramid.transpose(method)
+        self.left, self.top = 0.0, 0.0
+        self.request()
+
+    def request(self):
+        if self.frame_job is None:
+            self.frame_job = self.label.after(self.frame_delay, self.render_frame)
+        if self.refine_job is not None:
+            self.label.after_cancel(self.refine_job)
+        self.refine_job = self.label.after(self.refine_delay, self.render_refined)
+
+    def render_frame(self):
+        self.frame_job = None
+        self.render(INTERACTIVE_FILTER)
+
+    def render_refined(self):
+        self.refine_job = None
+        self.render(REFINED_FILTER)
+
+    def render(self, resample):
+        self.clamp()
+        width, height = self.view_size()
+        rendered = self.pyramid.render(self.scale(), self.left, self.top, width, height, resample)
+        img_tk = ImageTk.PhotoImage(rendered)
+        self.label.config(image=img_tk)
+        self.label.image = img_tk
+
+    def cancel(self):
+        for job in (self.frame_job, self.refine_job):
+            if job is not None:
+                self.label.after_cancel(job)
+        self.frame_job = None
+        self.refine_job = None
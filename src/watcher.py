@@ -0,0 +1,245 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import sys
+import time
+
+from scanner import walk, iter_images, is_image, is_hidden, is_pruned, pruned_directories
+
+logger = logging.getLogger("sortr.watcher")
+
+# From <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, name length
+
+
+class InotifyWatcher:
+    # Kernel change notifications on every directory of the tree, so a poll costs the number of events and not
+    # the size of the tree. Images are reported once they are closed after writing or moved into the tree.
+    def __init__(self, directory, output_directory=None):
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is only available on Linux")
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, f"inotify_init1: {os.strerror(error)}")
+        self.directory = directory
+        self.output_directory = output_directory if output_directory else directory
+        self.pruned = pruned_directories(directory, output_directory)
+        self.watches = {}  # watch descriptor -> directory
+        self.pending = []
+        self.unsettled = {}  # path -> (size, mtime_ns), found in a new directory and maybe still being written
+        try:
+            self.watch_tree(directory, report=False)
+        except OSError:
+            self.close()
+            raise
+
+    def add_watch(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            # ENOSPC means fs.inotify.max_user_watches is too low for this tree
+            raise OSError(error, f"inotify_add_watch: {os.strerror(error)}", path)
+        self.watches[wd] = path  # A directory moved within the tree keeps its wd, this updates its path
+
+    def watch_tree(self, directory, report):
+        # Every directory is watched before it is listed, so a file that lands in between is either in the
+        # listing or produces an event. Duplicates are fine, the caller skips files it already handled.
+        self.add_watch(directory)
+        for _, images, subdirectories in walk(directory, self.output_directory):
+            for subdirectory in subdirectories:
+                try:
+                    self.add_watch(subdirectory)
+                except FileNotFoundError:
+                    continue
+            if report:
+                for entry in images:
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    self.unsettled[entry.path] = (stat.st_size, stat.st_mtime_ns)
+
+    def poll(self, timeout):
+        # Returns the images that appeared or changed, waiting up to timeout seconds if there are none yet
+        if len(self.pending) == 0:
+            readable, _, _ = select.select([self.fd], [], [], timeout)
+            if readable:
+                self.read_events()
+        self.settle()
+        paths, self.pending = self.pending, []
+        return paths
+
+    def settle(self):
+        # Files that were complete before their directory was watched never send an event. They are reported
+        # once their size and mtime held still between two polls.
+        for path, identity in list(self.unsettled.items()):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                del self.unsettled[path]
+                continue
+            current = (stat.st_size, stat.st_mtime_ns)
+            if current == identity:
+                del self.unsettled[path]
+                self.pending.append(path)
+            else:
+                self.unsettled[path] = current
+
+    def read_events(self):
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+                offset += length
+                self.handle(wd, mask, name)
+
+    def handle(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            logger.info("Too many changes at once, events were dropped. Rescanning the tree")
+            self.pending.extend(iter_images(self.directory, self.output_directory))
+            return
+        if mask & IN_IGNORED:
+            self.watches.pop(wd, None)
+            return
+        directory = self.watches.get(wd)
+        if directory is None:
+            return
+        if is_hidden(name):
+            return
+        path = os.path.join(directory, name)
+        if mask & IN_ISDIR:
+            if not is_pruned(path, self.pruned):
+                try:
+                    self.watch_tree(path, report=True)
+                except OSError as e:
+                    logger.info(f"Could not watch {path}: {e}")
+        elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO) and is_image(name):
+            self.unsettled.pop(path, None)
+            self.pending.append(path)
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class PollingWatcher:
+    # Portable fallback that keeps the mtime of every directory. A poll stats each directory and only lists
+    # the ones whose mtime changed, so it costs one stat per directory plus the new files. Images are reported
+    # once their size and mtime held still for one interval, so half-copied files are not scored yet.
+    # Files rewritten in place, which does not touch the directory, are not noticed.
+    def __init__(self, directory, output_directory=None, interval=2):
+        self.interval = interval
+        self.pruned = pruned_directories(directory, output_directory)
+        self.directories = {}  # directory -> mtime_ns when it was last listed
+        self.files = {}  # directory -> {path: (size, mtime_ns)}
+        self.unsettled = {}  # path -> (size, mtime_ns) at the previous poll
+        self.next_check = time.monotonic() + interval
+        self.list_directory(directory, report=False)
+
+    def list_directory(self, directory, report):
+        stack = [directory]
+        while stack:
+            current = stack.pop()
+            try:
+                # The mtime is taken before listing, a file added meanwhile shows up on the next poll
+                mtime_ns = os.stat(current).st_mtime_ns
+                with os.scandir(current) as it:
+                    entries = list(it)
+            except OSError:
+                self.forget(current)
+                continue
+            self.directories[current] = mtime_ns
+            known = self.files.get(current, {})
+            files = {}
+            for entry in entries:
+                if is_hidden(entry.name):
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.path not in self.directories and not is_pruned(entry.path, self.pruned):
+                            stack.append(entry.path)
+                    elif is_image(entry.name) and entry.is_file():
+                        stat = entry.stat()
+                        identity = (stat.st_size, stat.st_mtime_ns)
+                        if report and known.get(entry.path) != identity:
+                            self.unsettled[entry.path] = identity
+                        else:
+                            files[entry.path] = identity
+                except OSError:
+                    continue
+            self.files[current] = files
+
+    def forget(self, directory):
+        self.directories.pop(directory, None)
+        self.files.pop(directory, None)
+
+    def poll(self, timeout):
+        wait = self.next_check - time.monotonic()
+        if wait > 0:
+            time.sleep(min(wait, timeout))
+            if time.monotonic() < self.next_check:
+                return []
+        self.next_check = time.monotonic() + self.interval
+        return self.check()
+
+    def check(self):
+        ready = []
+        for path, identity in list(self.unsettled.items()):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                del self.unsettled[path]
+                continue
+            current = (stat.st_size, stat.st_mtime_ns)
+            if current == identity:
+                del self.unsettled[path]
+                self.files.setdefault(os.path.dirname(path), {})[path] = identity
+                ready.append(path)
+            else:
+                self.unsettled[path] = current
+        for directory, mtime_ns in list(self.directories.items()):
+            try:
+                changed = os.stat(directory).st_mtime_ns != mtime_ns
+            except OSError:
+                self.forget(directory)
+                continue
+            if changed:
+                self.list_directory(directory, report=True)
+        return ready
+
+    def close(self):
+        pass
+
+
+def create_watcher(directory, output_directory=None, backend="auto", interval=2):
+    # backend is "auto", "inotify" or "polling". auto falls back to polling when inotify is unavailable,
+    # e.g. on other platforms, network file systems or when the watch limit is too low for the tree.
+    if backend in ("auto", "inotify"):
+        try:
+            return InotifyWatcher(directory, output_directory)
+        except (OSError, AttributeError) as e:
+            if backend == "inotify":
+                raise
+            logger.info(f"inotify is not available ({e}), polling every {interval}s instead")
+    return PollingWatcher(directory, output_directory, interval)
@@ -0,0 +1,68 @@
+import os
+import random
+
+from PIL import Image, ImageDraw
+
+from bursts import burst_key, find_groups
+
+
+def horizon(path, rng):
+    # Sky over sea with a dorsal fin, the unrelated but similar scenes of a survey folder
+    width, height = 320, 240
+    image = Image.new("L", (width, height), rng.randint(170, 220))
+    draw = ImageDraw.Draw(image)
+    line = rng.randint(90, 150)
+    draw.rectangle((0, line, width, height), fill=rng.randint(60, 110))
+    x = rng.randint(40, 260)
+    size = rng.randint(15, 45)
+    draw.polygon([(x, line + 5), (x + size // 3, line - size), (x + size, line + 5)], fill=rng.randint(10, 40))
+    image.save(path)
+    return path
+
+
+def test_unrelated_similar_scenes_stay_in_separate_groups(tmp_path):
+    rng = random.Random(0)
+    paths = [horizon(str(tmp_path / f"{i:04d}.png"), rng) for i in range(300)]
+    keys = [(path, burst_key(path)["hash"], None) for path in paths]
+
+    groups = find_groups(keys, max_distance=10)
+
+    assert max(len(group) for group in groups) <= 5
+    assert sorted(path for group in groups for path in group) == paths
+
+
+def test_a_group_is_compared_with_its_first_image():
+    # Every image is within 2 bits of the one before, but drifts away from the first
+    keys = [(f"d/{i}.jpg", (1 << i) - 1, None) for i in range(12)]
+
+    groups = find_groups(keys, max_distance=3)
+
+    assert groups == [["d/0.jpg", "d/1.jpg", "d/2.jpg", "d/3.jpg"], ["d/4.jpg", "d/5.jpg", "d/6.jpg", "d/7.jpg"],
+                      ["d/8.jpg", "d/9.jpg", "d/10.jpg", "d/11.jpg"]]
+
+
+def test_only_adjacent_images_of_a_folder_or_close_capture_times_group():
+    keys = [("a/1.jpg", 0, None), ("b/1.jpg", 0, None), ("a/2.jpg", 0, None), ("a/3.jpg", 0xFFFF, None),
+            ("a/4.jpg", 0, None)]
+    assert find_groups(keys) == [["a/1.jpg", "a/2.jpg"], ["b/1.jpg"], ["a/3.jpg"], ["a/4.jpg"]]
+
+    timed = [("a/1.jpg", 0, 100.0), ("a/2.jpg", 0xFFFF, 101.0), ("a/3.jpg", 0, 102.0), ("a/4.jpg", 0, 200.0)]
+    assert find_groups(timed, window=5) == [["a/1.jpg", "a/3.jpg"], ["a/2.jpg"], ["a/4.jpg"]]
+
+
+def test_burst_key_reads_the_capture_time(tmp_path):
+    image = Image.new("RGB", (64, 48), "gray")
+    exif = Image.Exif()
+    exif[0x0132] = "2024:05:01 10:20:30"
+    path = os.path.join(str(tmp_path), "a.jpg")
+    image.save(path, exif=exif)
+    assert burst_key(path)["time"] is not None
+    assert burst_key(str(tmp_path / "a.jpg"))["hash"] == burst_key(path)["hash"]
+
+
+def test_a_burst_split_across_card_folders_stays_one_group():
+    keys = [("100CANON/9999.jpg", 0, 100.0), ("101CANON/0001.jpg", 1, 101.0), ("101CANON/0002.jpg", 0, 300.0)]
+    assert find_groups(keys, window=5) == [["100CANON/9999.jpg", "101CANON/0001.jpg"], ["101CANON/0002.jpg"]]
+
+    untimed = [(path, value, None) for path, value, _ in keys]
+    assert find_groups(untimed, window=5) == [["100CANON/9999.jpg"], ["101CANON/0001.jpg", "101CANON/0002.jpg"]]
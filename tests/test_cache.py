@@ -0,0 +1,74 @@
+import itertools
+import os
+import shutil
+
+from cache import ScoreCache
+
+
+class Clock:
+    # Strictly increasing time, so last_used orders the entries in the order they were used
+    def __init__(self):
+        self.ticks = itertools.count(1000)
+
+    def time(self):
+        return float(next(self.ticks))
+
+
+def make_file(path, content=b"image"):
+    with open(path, "wb") as f:
+        f.write(content)
+    return path
+
+
+def test_an_entry_goes_stale_when_size_or_mtime_changes(tmp_path):
+    cache = ScoreCache(str(tmp_path / "scores.sqlite"))
+    resized = make_file(str(tmp_path / "a.jpg"))
+    touched = make_file(str(tmp_path / "b.jpg"))
+    for path in (resized, touched):
+        cache.put_score(path, "image@0", {"Sharpness": 1.5})
+        assert cache.get_score(path, "image@0") == {"Sharpness": 1.5}
+
+    stat = os.stat(resized)
+    make_file(resized, b"a larger image")
+    os.utime(resized, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    stat = os.stat(touched)
+    os.utime(touched, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    assert cache.get_score(resized, "image@0") is None
+    assert cache.get_score(touched, "image@0") is None
+    cache.close()
+
+
+def test_moved_keeps_the_entry_under_the_new_path(tmp_path):
+    cache = ScoreCache(str(tmp_path / "scores.sqlite"))
+    renamed = make_file(str(tmp_path / "a.jpg"))
+    into_directory = make_file(str(tmp_path / "b.jpg"))
+    cache.put_score(renamed, "image@0", {"Sharpness": 1.5})
+    cache.put_score(into_directory, "image@0", {"Sharpness": 2.5})
+    os.makedirs(str(tmp_path / "blurry"))
+
+    shutil.move(renamed, str(tmp_path / "c.jpg"))
+    cache.moved(renamed, str(tmp_path / "c.jpg"))
+    shutil.move(into_directory, str(tmp_path / "blurry"))
+    cache.moved(into_directory, str(tmp_path / "blurry"))
+
+    assert cache.get_score(str(tmp_path / "c.jpg"), "image@0") == {"Sharpness": 1.5}
+    assert cache.get_score(str(tmp_path / "blurry" / "b.jpg"), "image@0") == {"Sharpness": 2.5}
+    # A new file at the old path does not inherit the entry
+    make_file(renamed)
+    assert cache.get_score(renamed, "image@0") is None
+    cache.close()
+
+
+def test_evict_drops_the_least_recently_used_entries(tmp_path, monkeypatch):
+    monkeypatch.setattr("cache.time", Clock())
+    cache = ScoreCache(str(tmp_path / "scores.sqlite"), max_entries=2)
+    paths = [make_file(str(tmp_path / f"{i}.jpg")) for i in range(4)]
+    for path in paths:
+        cache.put_score(path, "image@0", {"Sharpness": 1.5})
+    cache.get_score(paths[0], "image@0")  # The oldest entry is used again
+
+    cache.evict()
+
+    assert [cache.get_score(path, "image@0") is not None for path in paths] == [True, False, False, True]
+    cache.close()
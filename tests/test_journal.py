@@ -0,0 +1,137 @@
+import json
+import os
+from argparse import Namespace
+
+from actions import MoveAction, MoveActionType
+from defaults import DEFAULT_SETTINGS
+from engine import SortrEngine
+from journal import MoveJournal
+from mover import MoveExecutor, MoveStatus
+
+
+def make_file(path, content=b"image"):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+    return path
+
+
+def records(journal_path):
+    with open(journal_path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def move_all(journal, moves):
+    executor = MoveExecutor(journal=journal)
+    actions = []
+    for source, target in moves:
+        action = MoveAction(source, target, MoveActionType.FILTER)
+        executor.submit(action)
+        actions.append(action)
+    executor.wait()
+    return actions
+
+
+def test_recover_finishes_and_rolls_back_interrupted_moves(tmp_path):
+    journal_path = str(tmp_path / "moves.journal")
+    done = make_file(str(tmp_path / "out" / "a.jpg"))
+    not_started = make_file(str(tmp_path / "in" / "b.jpg"))
+    with open(journal_path, "w", encoding="utf-8") as f:
+        for journal_id, source, target in (("a", str(tmp_path / "in" / "a.jpg"), done),
+                                           ("b", not_started, str(tmp_path / "out" / "b.jpg"))):
+            f.write(json.dumps({"id": journal_id, "event": "begin", "direction": "move", "from": source,
+                                "to": target, "type": "FILTER", "session": "crashed"}) + "\n")
+
+    journal = MoveJournal(journal_path)
+    live = journal.recover()
+    journal.close()
+
+    assert [action.to_path for action in live] == [done]
+    assert live[0].status == MoveStatus.DONE
+    assert os.path.exists(not_started)
+    assert [record["event"] for record in records(journal_path)] == ["begin", "commit"]
+
+
+def test_compact_keeps_only_applied_moves(tmp_path):
+    journal = MoveJournal(str(tmp_path / "moves.journal"))
+    moves = [(make_file(str(tmp_path / "in" / f"{i}.jpg")), str(tmp_path / "out" / f"{i}.jpg")) for i in range(3)]
+    actions = move_all(journal, moves)
+
+    journal.compact(actions[1:])
+    live = journal.recover()
+    journal.close()
+
+    assert [action.journal_id for action in live] == [action.journal_id for action in actions[1:]]
+    assert len(records(journal.path)) == 4
+
+
+def test_writes_after_another_process_recovered_are_kept(tmp_path):
+    journal_path = str(tmp_path / "moves.journal")
+    gui = MoveJournal(journal_path)
+    cli = MoveJournal(journal_path)
+    first = move_all(gui, [(make_file(str(tmp_path / "in" / "a.jpg")), str(tmp_path / "out" / "a.jpg"))])
+
+    cli.recover()
+    second = move_all(gui, [(make_file(str(tmp_path / "in" / "b.jpg")), str(tmp_path / "out" / "b.jpg"))])
+    cli.close()
+    gui.close()
+
+    restarted = MoveJournal(journal_path)
+    live = restarted.recover()
+    restarted.close()
+    assert [action.journal_id for action in live] == [first[0].journal_id, second[0].journal_id]
+
+
+def test_recover_leaves_moves_of_running_sessions_alone(tmp_path):
+    journal_path = str(tmp_path / "moves.journal")
+    running = MoveJournal(journal_path)
+    source = make_file(str(tmp_path / "in" / "a.jpg"))
+    target = str(tmp_path / "out" / "a.jpg")
+    action = MoveAction(source, target, MoveActionType.FILTER)
+    running.begin(action)
+
+    other = MoveJournal(journal_path)
+    assert other.recover() == []
+    other.close()
+
+    # The running session finishes its move after the other one recovered
+    make_file(target)
+    os.remove(source)
+    running.commit(action)
+    running.close()
+
+    restarted = MoveJournal(journal_path)
+    live = restarted.recover()
+    restarted.close()
+    assert [recovered.journal_id for recovered in live] == [action.journal_id]
+
+
+def test_undo_after_restart_is_limited_to_the_input_tree_and_keeps_the_cache(tmp_path):
+    input_directory = str(tmp_path / "in")
+    other_directory = str(tmp_path / "other")
+    args = Namespace(**dict(DEFAULT_SETTINGS, input_directory=input_directory, output_directory="",
+                            cache_path=str(tmp_path / "scores.sqlite"),
+                            journal_path=str(tmp_path / "moves.journal")))
+    engine = SortrEngine(args.journal_path)
+    cache = engine.get_cache(args)
+    paths = [make_file(os.path.join(input_directory, f"{i}.jpg"), bytes([i])) for i in range(3)]
+    elsewhere = make_file(os.path.join(other_directory, "x.jpg"))
+    for path in paths + [elsewhere]:
+        cache.put_score(path, "image@0", {"Sharpness": 1.0})
+    for path in paths + [elsewhere]:
+        engine.filter_move(args, path, cache)
+    engine.close()
+
+    restarted = SortrEngine(args.journal_path)
+    restarted.is_running = True
+    restarted.recover_moves(args)
+    undone = restarted.undo_all(MoveActionType.FILTER, input_directory)
+    restarted.mover.wait()
+    cache = restarted.get_cache(args)
+
+    assert sorted(action.from_path for action in undone) == sorted(paths)
+    assert all(os.path.exists(path) for path in paths)
+    assert not os.path.exists(elsewhere)
+    assert all(cache.get_score(path, "image@0") == {"Sharpness": 1.0} for path in paths)
+    assert [action.from_path for action in restarted.filter_history] == [elsewhere]
+    restarted.close()
@@ -0,0 +1,76 @@
+import os
+import threading
+
+import pytest
+
+import mover
+from actions import MoveAction, MoveActionType
+from mover import MoveExecutor, MoveStatus, prepare_target
+
+
+def make_file(path, content=b"image"):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+    return path
+
+
+def action_for(tmp_path, name):
+    source = make_file(str(tmp_path / "in" / name))
+    return MoveAction(source, str(tmp_path / "in" / ".too_blurry" / name), MoveActionType.FILTER)
+
+
+def test_undoing_a_queued_move_drops_it(tmp_path):
+    executor = MoveExecutor()
+    action = action_for(tmp_path, "a.jpg")
+    # Holding the condition keeps the worker from taking the move off the queue in between
+    with executor.condition:
+        executor.submit(action)
+        executor.undo(action)
+    executor.wait()
+
+    assert action.status == MoveStatus.CANCELLED
+    assert os.path.exists(action.from_path) and not os.path.exists(action.to_path)
+    assert executor.pending() == 0 and executor.failures == []
+
+
+def test_an_undo_waits_for_the_cross_device_copy_it_reverts(tmp_path, monkeypatch):
+    started, release = threading.Event(), threading.Event()
+    copy = mover.copy_then_unlink
+
+    def slow_copy(source, target):
+        started.set()
+        release.wait(5)
+        copy(source, target)
+
+    monkeypatch.setattr(mover, "same_device", lambda source, target_directory: False)
+    monkeypatch.setattr(mover, "copy_then_unlink", slow_copy)
+    executor = MoveExecutor()
+    action = action_for(tmp_path, "a.jpg")
+    executor.submit(action)
+    assert started.wait(5)
+    assert executor.busy(action.from_path)
+
+    executor.undo(action)
+    release.set()
+    executor.wait()
+
+    assert action.status == MoveStatus.UNDONE
+    assert os.path.exists(action.from_path) and not os.path.exists(action.to_path)
+    assert not os.path.exists(action.to_path + mover.PARTIAL_SUFFIX)
+
+
+def test_an_existing_destination_is_never_overwritten(tmp_path):
+    action = action_for(tmp_path, "a.jpg")
+    make_file(action.to_path, b"another image")
+    with pytest.raises(FileExistsError):
+        prepare_target(action.to_path, set())
+
+    executor = MoveExecutor()
+    executor.submit(action)
+    executor.wait()
+
+    assert action.status == MoveStatus.FAILED and executor.failures == [action]
+    with open(action.to_path, "rb") as f:
+        assert f.read() == b"another image"
+    assert os.path.exists(action.from_path)
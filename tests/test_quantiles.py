@@ -0,0 +1,47 @@
+import random
+
+from quantiles import KLLSketch, PercentileSelector
+
+SCORES = [412.0, 88.5, 1630.2, 95.1, 740.9, 233.0, 61.7, 1210.4, 530.3, 77.2, 980.6, 150.8]
+
+
+def select(scores, percent, buffer_size):
+    selector = PercentileSelector(percent, buffer_size, KLLSketch())
+    dropped = []
+    for index, score in enumerate(scores):
+        dropped.extend(path for path, _ in selector.add(index, score))
+        assert len(dropped) <= percent / 100 * (index + 1)
+    return dropped + [path for path, _ in selector.finish()]
+
+
+def test_a_score_at_the_cut_off_is_dropped():
+    # The sketch's quantile is a score of the stream, with only a few scores it is the lowest one itself
+    assert len(select(SCORES, 25, 3)) == 3
+    assert sorted(SCORES[index] for index in select(SCORES, 25, 3)) == [61.7, 77.2, 88.5]
+
+
+def test_finish_spends_the_remaining_budget_on_the_lowest_buffered_scores():
+    dropped = select([500.0, 400.0, 300.0, 200.0], 50, 10)
+
+    assert dropped == [3, 2]
+
+
+def test_random_order_drops_the_lowest_percent():
+    rng = random.Random(0)
+    scores = [rng.lognormvariate(5, 1) for _ in range(20000)]
+    cut = sorted(scores)[len(scores) // 5]
+
+    dropped = select(scores, 20, 200)
+
+    assert 0.19 * len(scores) <= len(dropped) <= 0.2 * len(scores)
+    assert sum(1 for index in dropped if scores[index] <= cut) >= 0.95 * len(dropped)
+
+
+def test_ascending_scores_still_drop_the_percent():
+    # Every image is the sharpest seen yet when it is decided, the drops catch up with a raised cut-off
+    rng = random.Random(1)
+    scores = sorted(rng.lognormvariate(5, 1) for _ in range(20000))
+
+    dropped = select(scores, 20, 200)
+
+    assert 0.19 * len(scores) <= len(dropped) <= 0.2 * len(scores)
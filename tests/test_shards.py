@@ -0,0 +1,42 @@
+import os
+from argparse import Namespace
+
+import pytest
+
+from defaults import DEFAULT_SETTINGS
+from engine import SortrEngine
+from shards import expand_result_paths
+from stats_writer import read_records
+
+
+def write_result(path, names):
+    with open(path, "w") as f:
+        for name in names:
+            f.write(f'{{"File": "{name}", "Sharpness": 1.5}}\n')
+    return path
+
+
+def test_a_glob_leaves_out_the_merged_output(tmp_path):
+    results = [write_result(str(tmp_path / f"r{i}.jsonl"), [f"{i}.jpg"]) for i in range(2)]
+    merged = write_result(str(tmp_path / "merged.jsonl"), ["0.jpg", "1.jpg"])
+
+    paths = expand_result_paths([str(tmp_path / "*.jsonl")], merged)
+
+    assert paths == results
+    assert merged in expand_result_paths([str(tmp_path / "*.jsonl")])
+
+
+def test_merging_into_one_of_the_results_is_refused(tmp_path):
+    results = [write_result(str(tmp_path / f"r{i}.jsonl"), [f"{i}.jpg"]) for i in range(2)]
+    settings = dict(DEFAULT_SETTINGS, input_directory=str(tmp_path), output_directory="",
+                    cache_path=str(tmp_path / "cache" / "scores.sqlite"),
+                    journal_path=str(tmp_path / "cache" / "moves.journal"))
+    engine = SortrEngine(settings["journal_path"])
+    engine.is_running = True
+
+    with pytest.raises(ValueError):
+        engine.merge_shards(Namespace(**settings), expand_result_paths(results, results[0]), results[0])
+    engine.close()
+
+    assert os.path.exists(results[0])
+    assert [record["File"] for record in read_records(results[0])] == ["0.jpg"]
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from sharpness import tile_variances
+
+
+def brute_force(pixels, rows, cols):
+    height, width = pixels.shape
+    ys = np.linspace(0, height, rows + 1).astype(np.int64)
+    xs = np.linspace(0, width, cols + 1).astype(np.int64)
+    return np.array([[pixels[ys[row]:ys[row + 1], xs[col]:xs[col + 1]].astype(np.float64).var()
+                      for col in range(cols)] for row in range(rows)])
+
+
+@pytest.mark.parametrize("dtype", [np.uint8, np.int32])
+def test_tile_variances_match_the_variance_of_every_tile(dtype):
+    # Uneven sizes, so the tiles differ in size and the band and column edges fall between pixels
+    pixels = np.random.default_rng(0).integers(0, 256, size=(37, 53)).astype(dtype)
+
+    variances = tile_variances(pixels, 3, 5)
+
+    assert variances.shape == (3, 5)
+    np.testing.assert_allclose(variances, brute_force(pixels, 3, 5), rtol=1e-9, atol=1e-6)
+
+
+def test_a_flat_tile_has_no_variance():
+    pixels = np.zeros((37, 53), dtype=np.uint8)
+    pixels[20:, 30:] = np.random.default_rng(1).integers(0, 256, size=(17, 23))
+
+    variances = tile_variances(pixels, 3, 5)
+
+    assert variances[0, 0] == 0
+    np.testing.assert_allclose(variances, brute_force(pixels, 3, 5), rtol=1e-9, atol=1e-6)
@@ -0,0 +1,68 @@
+import os
+from argparse import Namespace
+
+import pytest
+from PIL import Image, ImageDraw
+
+from defaults import DEFAULT_SETTINGS
+from engine import SortrEngine
+from stats_writer import StatsWriter, read_records, resumable_path
+
+FIELDS = ["File", "Sharpness"]
+SETTINGS = {"scoring_resolution": 0}
+
+
+def test_resume_appends_with_matching_fields_and_settings(tmp_path):
+    path = str(tmp_path / "image_statistics.csv")
+    writer = StatsWriter(path, "csv", FIELDS, settings=SETTINGS)
+    writer.write({"File": "a.jpg", "Sharpness": 1.5})
+    writer.close()
+
+    assert resumable_path(path, FIELDS, SETTINGS) == path
+    writer = StatsWriter(path, "csv", FIELDS, settings=SETTINGS)
+    assert writer.recorded == {"a.jpg"}
+    writer.write({"File": "b.jpg", "Sharpness": 2.5})
+    writer.close()
+    assert [record["Sharpness"] for record in read_records(path)] == [1.5, 2.5]
+
+
+def test_other_fields_or_settings_get_a_file_of_their_own(tmp_path):
+    path = str(tmp_path / "image_statistics.csv")
+    writer = StatsWriter(path, "csv", FIELDS, settings=SETTINGS)
+    writer.write({"File": "a.jpg", "Sharpness": 1.5})
+    writer.close()
+
+    other_fields = resumable_path(path, FIELDS + ["Noise"], SETTINGS)
+    other_settings = resumable_path(path, FIELDS, {"scoring_resolution": 1024})
+    assert len({path, other_fields, other_settings}) == 3
+    # The same settings find their file again on the next run
+    assert resumable_path(path, FIELDS + ["Noise"], SETTINGS) == other_fields
+
+
+def test_resume_without_matching_settings_is_refused(tmp_path):
+    path = str(tmp_path / "result.jsonl")
+    with open(path, "w") as f:
+        f.write('{"File": "a.jpg", "Sharpness": 1.5}\n')
+    with pytest.raises(ValueError):
+        StatsWriter(path, "jsonl", FIELDS, settings=SETTINGS)
+
+
+def test_stats_runs_with_different_metrics_do_not_mix(tmp_path):
+    for i in range(3):
+        image = Image.new("L", (64, 48), 128)
+        ImageDraw.Draw(image).rectangle((8 * i, 8, 40, 30), fill=255)
+        image.save(str(tmp_path / f"{i}.png"))
+    settings = dict(DEFAULT_SETTINGS, input_directory=str(tmp_path), output_directory="", scoring_workers=1,
+                    stats_format="csv", cache_path=str(tmp_path / "cache" / "scores.sqlite"),
+                    journal_path=str(tmp_path / "cache" / "moves.journal"))
+    engine = SortrEngine(settings["journal_path"])
+    engine.is_running = True
+    first = engine.generate_stats(Namespace(**settings))
+    second = engine.generate_stats(Namespace(**dict(settings, quality_metrics="sharpness,noise")))
+    engine.close()
+
+    assert first != second
+    assert all(None not in record for record in read_records(first))
+    assert [sorted(record) for record in read_records(second)] == \
+        [sorted(FIELDS + ["Width", "Height", "Orientation", "DecodeTime", "Noise"])] * 3
+    assert os.path.basename(first) == "image_statistics.csv"